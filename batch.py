@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+
+from document_cache import document_cache, file_sha256
+from llm_cache import llm_cache
+from ocr import PAGE_SEPARATOR
+from ocr_executor import OCR_MAX_WORKERS, OcrExecutor
+from post_processing import generate_response, llm_client
+
+
+LLM_CONCURRENCY = 4
+
+
+def find_pdfs(source: str) -> list:
+    if os.path.isdir(source):
+        pattern = os.path.join(source, "**", "*.pdf")
+    else:
+        pattern = source
+    return sorted(os.path.abspath(path) for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+
+
+def load_checkpoint(output_path: str, retry_errors: bool) -> set:
+    # every document already written to the output is skipped on restart
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line may be cut off by an interruption
+                continue
+            if record.get("error") is None or not retry_errors:
+                done.add(record["path"])
+    return done
+
+
+async def process_document(path: str, executor: OcrExecutor, temp_dir: str) -> dict:
+    record = {"path": path, "sha256": None, "pages": None, "features": None, "timings": {}, "error": None}
+    started = time.perf_counter()
+    try:
+        digest = file_sha256(path)
+        record["sha256"] = digest
+        pages = document_cache.get(digest)
+        if pages is None:
+            pages = await executor.extract_pages(path, temp_dir)
+            document_cache.put(digest, pages)
+        record["pages"] = len(pages)
+        record["timings"]["ocr"] = round(time.perf_counter() - started, 3)
+
+        llm_started = time.perf_counter()
+        features = await generate_response(PAGE_SEPARATOR.join(pages))
+        record["features"] = features.to_dict()
+        record["timings"]["llm"] = round(time.perf_counter() - llm_started, 3)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["timings"]["total"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+async def run_batch(paths: list, output_path: str, workers: int, llm_concurrency: int, temp_dir: str) -> None:
+    executor = OcrExecutor(max_workers=workers, max_in_flight=workers * 2)
+    llm_client.set_max_concurrency(llm_concurrency)
+    queue = asyncio.Queue()
+    for path in paths:
+        queue.put_nowait(path)
+
+    processed = 0
+    failed = 0
+    started = time.perf_counter()
+
+    async def worker(output) -> None:
+        nonlocal processed, failed
+        while True:
+            try:
+                path = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            record = await process_document(path, executor, temp_dir)
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            processed += 1
+            if record["error"] is not None:
+                failed += 1
+                print(f"[{processed}/{len(paths)}] {path}: {record['error']}")
+            elif processed % 50 == 0 or processed == len(paths):
+                rate = processed / (time.perf_counter() - started)
+                print(f"[{processed}/{len(paths)}] {rate:.2f} documents/s, failed: {failed}")
+
+    # enough documents in flight to keep both the OCR pool and the LLM slots busy
+    with open(output_path, "a", encoding="utf-8") as output:
+        try:
+            await asyncio.gather(*[worker(output) for _ in range(workers * 2 + llm_concurrency)])
+        finally:
+            executor.shutdown()
+            await llm_client.close()
+            document_cache.close()
+            llm_cache.close()
+    print(f"Done: {processed} documents, {failed} failed, {time.perf_counter() - started:.1f} s.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Extract features from a directory of PDFs into a JSONL file.")
+    parser.add_argument("source", help="directory with PDF files or a glob pattern")
+    parser.add_argument("-o", "--output", default="features.jsonl", help="JSONL file, also used as the checkpoint")
+    parser.add_argument("-w", "--workers", type=int, default=OCR_MAX_WORKERS, help="OCR worker processes")
+    parser.add_argument("-l", "--llm-concurrency", type=int, default=LLM_CONCURRENCY,
+                        help="concurrent LLM requests")
+    parser.add_argument("--temp-dir", default=None,
+                        help="directory for OCR intermediate files, config.OCR_TEMP_ROOT or the system temp by default")
+    parser.add_argument("--retry-errors", action="store_true", help="process documents that failed before again")
+    args = parser.parse_args()
+
+    temp_dir = args.temp_dir
+    if temp_dir is not None:
+        os.makedirs(temp_dir, exist_ok=True)
+
+    done = load_checkpoint(args.output, args.retry_errors)
+    paths = [path for path in find_pdfs(args.source) if path not in done]
+    print(f"{len(paths)} documents to process, {len(done)} already in {args.output}.")
+    if paths:
+        asyncio.run(run_batch(paths, args.output, args.workers, args.llm_concurrency, temp_dir))
+
+
+if __name__ == "__main__":
+    main()
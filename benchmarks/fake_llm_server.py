@@ -0,0 +1,126 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+FEATURE_LINE_PATTERN = re.compile(r"^\s*([А-ЯЁA-Z][^:\n]{2,60}?)\s*[:.]{1,}\s*([^\n]{1,80})$", re.MULTILINE)
+
+
+def fake_answer(prompt: str) -> str:
+    # echo the 'key: value' lines of the document back as a python dict, like the real model does
+    features = {}
+    for key, value in FEATURE_LINE_PATTERN.findall(prompt):
+        features.setdefault(key.strip().replace("'", ""), value.strip().replace("'", ""))
+    if not features:
+        features = {"Тип": "Неизвестно"}
+    body = ",\n".join(f"    '{key}': '{value}'" for key, value in features.items())
+    return "Вот характеристики товара:\n{\n" + body + "\n}"
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    latency = 1.0
+    jitter = 0.3
+    error_rate = 0.0
+    rate_limit_rate = 0.0
+    tokens_per_second = 200.0
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            self._send_json(429, {"error": {"message": "rate limited", "type": "requests", "code": "rate_limit"}},
+                            {"Retry-After": "1"})
+            return
+        if roll < self.rate_limit_rate + self.error_rate:
+            self._send_json(500, {"error": {"message": "internal error", "type": "server_error"}})
+            return
+
+        prompt = "\n".join(message.get("content") or "" for message in request.get("messages", []))
+        answer = fake_answer(prompt)
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+        if request.get("stream"):
+            self._stream(request, answer)
+            return
+        self._send_json(200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": answer}}],
+            "usage": {"prompt_tokens": len(prompt) // 3, "completion_tokens": len(answer) // 3,
+                      "total_tokens": (len(prompt) + len(answer)) // 3},
+        })
+
+    def _stream(self, request: dict, answer: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        step = 12
+        for i in range(0, len(answer), step):
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "delta": {"content": answer[i:i + step]}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(step / 3 / self.tokens_per_second)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, latency: float = 1.0, jitter: float = 0.3,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0) -> ThreadingHTTPServer:
+    handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {
+        "latency": latency, "jitter": jitter, "error_rate": error_rate, "rate_limit_rate": rate_limit_rate,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible chat completions stand-in.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.0, help="mean seconds before the answer")
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered with 429")
+    args = parser.parse_args()
+    server = start_server(port=args.port, latency=args.latency, jitter=args.jitter,
+                          error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+    print(f"Fake LLM server on http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import json
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+FIRST_CHAT_ID = 1000000
+SEQUENCE_PATTERN = re.compile(r"user\d+-(\d+)")
+
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    # answers Bot API calls like Telegram would and records what the bot sends to every chat
+    sent = {}
+    lock = threading.Lock()
+    next_message_id = [1]
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _parameters(self) -> dict:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+            return json.loads(body or b"{}")
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        return {}
+
+    def _message(self, parameters: dict) -> dict:
+        with self.lock:
+            message_id = self.next_message_id[0]
+            self.next_message_id[0] += 1
+        chat_id = int(parameters.get("chat_id", 0))
+        return {"message_id": message_id, "date": int(time.time()), "text": parameters.get("text", ""),
+                "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER}
+
+    def do_POST(self) -> None:
+        method = self.path.rsplit("/", 1)[-1]
+        parameters = self._parameters()
+        if method == "getMe":
+            result = BOT_USER
+        elif method in ("sendMessage", "sendDocument", "editMessageText"):
+            result = self._message(parameters)
+            if method == "sendMessage":
+                with self.lock:
+                    self.sent.setdefault(result["chat"]["id"], []).append(result["text"])
+        else:
+            result = True
+        data = json.dumps({"ok": True, "result": result}, ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    handler = type("RecordingBotAPIHandler", (FakeBotAPIHandler,), {
+        "sent": {}, "lock": threading.Lock(), "next_message_id": [1],
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def generate_updates(chats: int, updates_per_chat: int) -> dict:
+    # /start from every chat, the user's name carries the sequence number the reply echoes back
+    updates = {}
+    update_id = 1
+    for sequence in range(updates_per_chat):
+        for chat_no in range(chats):
+            chat_id = FIRST_CHAT_ID + chat_no
+            user = {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}-{sequence}"}
+            updates.setdefault(chat_id, []).append({
+                "update_id": update_id,
+                "message": {
+                    "message_id": sequence + 1,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]},
+                    "from": user,
+                    "text": "/start",
+                    "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+                },
+            })
+            update_id += 1
+    return updates
+
+
+def post_updates(webhook_url: str, updates: list, secret: str = None) -> None:
+    # one chat's updates are posted one after another, like Telegram delivers them
+    headers = {"Content-Type": "application/json"}
+    if secret is not None:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    for update in updates:
+        request = urllib.request.Request(webhook_url, data=json.dumps(update).encode(), headers=headers)
+        urllib.request.urlopen(request, timeout=30).close()
+
+
+def wait_for(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(url, timeout=5).close()
+            return
+        except urllib.error.HTTPError:
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def order_violations(sent: dict) -> list:
+    violations = []
+    for chat_id, texts in sent.items():
+        sequence = [int(match.group(1)) for match in map(SEQUENCE_PATTERN.search, texts) if match]
+        if sequence != sorted(sequence):
+            violations.append(chat_id)
+    return violations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Stand-in Bot API plus an update generator for the webhook server. Start this first, then "
+                    "'python webhook_server.py --bot-api-url http://127.0.0.1:<api-port>/bot'.")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook-url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--updates", type=int, default=20, help="updates per chat")
+    parser.add_argument("--concurrency", type=int, default=16, help="chats posting at the same time")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for the webhook and the replies")
+    args = parser.parse_args()
+
+    server = start_server(port=args.api_port)
+    sent = server.RequestHandlerClass.sent
+    print(f"Fake Bot API on http://127.0.0.1:{server.server_address[1]}/bot, waiting for {args.webhook_url}")
+    wait_for(args.webhook_url, args.timeout)
+
+    updates = generate_updates(args.chats, args.updates)
+    total = args.chats * args.updates
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda chat_updates: post_updates(args.webhook_url, chat_updates, args.secret),
+                      updates.values()))
+    posted = time.perf_counter() - started
+
+    deadline = time.monotonic() + args.timeout
+    while sum(len(texts) for texts in list(sent.values())) < total and time.monotonic() < deadline:
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - started
+    replies = sum(len(texts) for texts in sent.values())
+
+    print(f"{total} updates posted in {posted:.2f} s, {replies} replies in {elapsed:.2f} s "
+          f"({replies / elapsed:.1f} updates/s)")
+    violations = order_violations(sent)
+    print(f"chats with replies out of order: {len(violations)}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
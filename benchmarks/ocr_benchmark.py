@@ -0,0 +1,94 @@
+import argparse
+import difflib
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import ocr
+from benchmarks.synthetic_pdfs import DEFAULT_FONT, spec_sheet_lines, write_scanned
+
+
+MODES = ("pdf", "sidecar")
+
+
+def make_scans(directory: str, documents: int, pages: int, font_path: str) -> list:
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for doc_no in range(documents):
+        path = os.path.join(directory, f"scan_{pages}p_{doc_no:04d}.pdf")
+        if not os.path.exists(path):
+            write_scanned(path, spec_sheet_lines(doc_no, pages), font_path, doc_no)
+        paths.append(path)
+    return paths
+
+
+def run_mode(paths: list, pages: int, mode: str, repeat: int) -> tuple:
+    # every page of every scan goes through ocr_pages in one range, like a fully scanned upload
+    durations = []
+    texts = {}
+    for _ in range(repeat):
+        for path in paths:
+            with open(path, "rb") as pdf_file:
+                data = pdf_file.read()
+            started = time.perf_counter()
+            result = ocr.ocr_pages(data, list(range(1, pages + 1)), mode=mode)
+            durations.append(time.perf_counter() - started)
+            texts[path] = [text for _, text in result]
+    return durations, texts
+
+
+def similarity(first: list, second: list) -> float:
+    first, second = "\n".join(first), "\n".join(second)
+    return difflib.SequenceMatcher(None, " ".join(first.split()), " ".join(second.split())).ratio()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Time OCR of multi-page scans with a rendered output PDF against the text sidecar.")
+    parser.add_argument("--documents", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--jobs", type=int, default=ocr.OCR_JOBS, help="tesseract processes per document")
+    parser.add_argument("--oversample", type=int, default=ocr.OCR_OVERSAMPLE_DPI, help="DPI, 0 keeps the scan's")
+    parser.add_argument("--psm", type=int, default=ocr.OCR_PAGESEGMODE, help="tesseract page segmentation mode")
+    parser.add_argument("--corpus", default=None, help="directory to keep the generated scans between runs")
+    parser.add_argument("--font", default=DEFAULT_FONT)
+    parser.add_argument("--save", default=None, help="write the results as JSON")
+    args = parser.parse_args()
+
+    ocr.OCR_JOBS = args.jobs
+    ocr.OCR_OVERSAMPLE_DPI = args.oversample
+    ocr.OCR_PAGESEGMODE = args.psm
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_scans(args.corpus or directory, args.documents, args.pages, args.font)
+        results = {}
+        texts = {}
+        for mode in MODES:
+            durations, texts[mode] = run_mode(paths, args.pages, mode, args.repeat)
+            results[mode] = {
+                "documents": len(durations),
+                "mean_s": round(statistics.mean(durations), 3),
+                "per_page_s": round(sum(durations) / (len(durations) * args.pages), 3),
+                "max_s": round(max(durations), 3),
+            }
+
+    for mode, result in results.items():
+        print(f"{mode:>8}: {result['mean_s']:.2f} s per document, {result['per_page_s']:.2f} s per page, "
+              f"max {result['max_s']:.2f} s")
+    speedup = results["pdf"]["mean_s"] / results["sidecar"]["mean_s"]
+    agreement = statistics.mean(similarity(texts["pdf"][path], texts["sidecar"][path]) for path in paths)
+    print(f"sidecar is {speedup:.2f}x faster, text agreement between the modes {agreement:.3f}")
+    results["speedup"] = round(speedup, 3)
+    results["agreement"] = round(agreement, 3)
+    results["settings"] = {"pages": args.pages, "jobs": args.jobs, "oversample": args.oversample, "psm": args.psm}
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
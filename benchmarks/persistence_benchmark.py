@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+import copy
+import os
+import random
+import tempfile
+import time
+
+from telegram.ext import ExtBot, PicklePersistence
+
+from data_converter import FeatureSet
+from sqlite_persistence import SQLitePersistence
+
+
+def make_user_data(user_id: int, ocr_size: int) -> dict:
+    features = FeatureSet({f"Характеристика {i}": f"{random.randint(1, 5000)} мм" for i in range(60)})
+    return {
+        "initial_prompt_txt": f"Технический паспорт изделия {user_id}. " * (ocr_size // 32),
+        "features": features,
+        "saved_features": {f"товар {i}": features.copy() for i in range(5)},
+        "assistant_messages_history": [],
+        "output_queries": [user_id],
+    }
+
+
+async def run_backend(persistence, users: dict, changed_per_round: int, rounds: int) -> float:
+    for user_id, data in users.items():
+        await persistence.update_user_data(user_id, copy.deepcopy(data))
+    if isinstance(persistence, PicklePersistence):
+        # filled in memory above, from here on every update is written out like in the bot
+        persistence.on_flush = False
+
+    elapsed = 0.0
+    for _ in range(rounds):
+        for user_id in random.sample(list(users), changed_per_round):
+            users[user_id]["features"][f"Характеристика {random.randint(0, 59)}"] = "изменено"
+            # PicklePersistence skips data equal to what it holds, so hand it a fresh copy
+            data = copy.deepcopy(users[user_id])
+            started = time.perf_counter()
+            await persistence.update_user_data(user_id, data)
+            elapsed += time.perf_counter() - started
+    await persistence.flush()
+    return elapsed
+
+
+async def run(users_count: int, ocr_size: int, changed_per_round: int, rounds: int) -> None:
+    # persistence that stores callback_data only accepts a bot that has it enabled
+    bot = ExtBot("0:benchmark", arbitrary_callback_data=True)
+    with tempfile.TemporaryDirectory() as directory:
+        backends = {
+            "pickle": PicklePersistence(filepath=os.path.join(directory, "bot_data.pickle"), on_flush=True),
+            "sqlite": SQLitePersistence(filepath=os.path.join(directory, "bot_data.sqlite3")),
+        }
+        for name, persistence in backends.items():
+            persistence.set_bot(bot)
+            random.seed(0)
+            users = {user_id: make_user_data(user_id, ocr_size) for user_id in range(users_count)}
+            elapsed = await run_backend(persistence, users, changed_per_round, rounds)
+            size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory)
+                       if f.startswith(os.path.basename(persistence.filepath)))
+            print(f"{name:>6}: {rounds * changed_per_round} updates in {elapsed:.2f} s "
+                  f"({elapsed / rounds * 1000:.1f} ms per round), on disk {size / 1024 / 1024:.1f} MB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare PicklePersistence and SQLitePersistence update cost.")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--ocr-size", type=int, default=30000, help="characters of OCR text per user")
+    parser.add_argument("--changed", type=int, default=20, help="users changed per round")
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.ocr_size, args.changed, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import post_processing
+from benchmarks.fake_llm_server import start_server
+from benchmarks.synthetic_pdfs import DEFAULT_FONT, generate_corpus
+from llm_cache import LLMCache
+from llm_client import TokenBucket
+from ocr import PAGE_SEPARATOR, extract_text_from_pdf
+from ocr_executor import OCR_MAX_WORKERS, OcrExecutor
+
+
+STAGES = ("text_layer", "ocr", "llm", "total")
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+async def process(path: str, executor: OcrExecutor, temp_dir: str, timings: dict) -> None:
+    # the bot keeps downloads in memory, so the pipeline works on bytes here too
+    with open(path, "rb") as f:
+        data = f.read()
+    started = time.perf_counter()
+    await executor.run(extract_text_from_pdf, data)
+    timings["text_layer"].append(time.perf_counter() - started)
+
+    ocr_started = time.perf_counter()
+    pages = await executor.extract_pages(data, temp_dir)
+    timings["ocr"].append(time.perf_counter() - ocr_started)
+
+    llm_started = time.perf_counter()
+    await post_processing.generate_response(PAGE_SEPARATOR.join(pages))
+    timings["llm"].append(time.perf_counter() - llm_started)
+    timings["total"].append(time.perf_counter() - started)
+
+
+async def run(documents: list, users: int, workers: int, temp_dir: str) -> dict:
+    executor = OcrExecutor(max_workers=workers, max_in_flight=workers * 2)
+    timings = {stage: [] for stage in STAGES}
+    errors = []
+    queue = asyncio.Queue()
+    for path, _ in documents:
+        queue.put_nowait(path)
+
+    async def user() -> None:
+        while not queue.empty():
+            path = queue.get_nowait()
+            try:
+                await process(path, executor, temp_dir, timings)
+            except Exception as e:
+                errors.append(f"{os.path.basename(path)}: {type(e).__name__}: {e}")
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*[user() for _ in range(users)])
+    finally:
+        elapsed = time.perf_counter() - started
+        executor.shutdown(wait=True)
+        await post_processing.llm_client.close()
+
+    return {
+        "documents": len(documents),
+        "users": users,
+        "workers": workers,
+        "errors": errors,
+        "throughput": (len(documents) - len(errors)) / elapsed,
+        "stages": {stage: {"p50": percentile(values, 0.5), "p95": percentile(values, 0.95), "count": len(values)}
+                   for stage, values in timings.items()},
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_worker_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def report(results: dict) -> None:
+    print(f"{results['documents']} documents, {results['users']} concurrent users, {results['workers']} OCR workers")
+    for stage, stats in results["stages"].items():
+        print(f"  {stage:>10}: p50 {stats['p50']:.3f} s, p95 {stats['p95']:.3f} s ({stats['count']} samples)")
+    print(f"  throughput: {results['throughput']:.2f} documents/s")
+    print(f"  peak RSS: {results['peak_rss_mb']:.0f} MB, OCR workers {results['peak_worker_rss_mb']:.0f} MB")
+    for error in results["errors"]:
+        print(f"  error: {error}")
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    found = []
+    for stage, stats in results["stages"].items():
+        before = baseline["stages"].get(stage, {}).get("p95")
+        if before and stats["p95"] > before * (1 + tolerance):
+            found.append(f"{stage} p95 {before:.3f} s -> {stats['p95']:.3f} s")
+    if results["throughput"] < baseline["throughput"] * (1 - tolerance):
+        found.append(f"throughput {baseline['throughput']:.2f} -> {results['throughput']:.2f} documents/s")
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the document pipeline.")
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--scanned-share", type=float, default=0.5)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--users", type=int, default=4, help="concurrent users")
+    parser.add_argument("--workers", type=int, default=OCR_MAX_WORKERS)
+    parser.add_argument("--corpus", default=None, help="directory to keep the generated PDFs between runs")
+    parser.add_argument("--font", default=DEFAULT_FONT)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--llm-jitter", type=float, default=0.3)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=float, default=6000, help="client side requests per minute")
+    parser.add_argument("--save", default=None, help="write the results as JSON")
+    parser.add_argument("--baseline", default=None, help="fail when p95 or throughput regress against this JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--temp-dir", default=None, help="OCR staging directory, config.OCR_TEMP_ROOT or the system temp by default")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = args.corpus or os.path.join(directory, "corpus")
+        documents = generate_corpus(corpus, args.documents, args.scanned_share, args.pages, args.font)
+
+        server = start_server(latency=args.llm_latency, jitter=args.llm_jitter,
+                              error_rate=args.llm_error_rate, rate_limit_rate=args.llm_rate_limit_rate)
+        post_processing.llm_client.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        post_processing.llm_client.bucket = TokenBucket(args.rpm)
+        post_processing.llm_cache = LLMCache(path=os.path.join(directory, "llm_cache"))
+
+        try:
+            results = asyncio.run(run(documents, args.users, args.workers, args.temp_dir))
+        finally:
+            server.shutdown()
+
+    report(results)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION: {regression}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import argparse
+import os
+import random
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+
+DEFAULT_FONT = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+SCAN_DPI = 200
+LINES_PER_PAGE = 40
+
+FEATURES = [
+    ("Длина", "мм", 2500, 6000),
+    ("Ширина", "мм", 1500, 2600),
+    ("Высота", "мм", 1800, 2600),
+    ("Клиренс", "мм", 300, 700),
+    ("Масса", "кг", 800, 4000),
+    ("Грузоподъемность", "кг", 300, 1500),
+    ("Мощность двигателя", "л.с.", 30, 150),
+    ("Расход топлива", "л/ч", 2, 9),
+    ("Скорость на суше", "км/ч", 30, 80),
+    ("Скорость на воде", "км/ч", 3, 10),
+    ("Объем топливного бака", "л", 40, 200),
+    ("Автономность хода", "часов", 20, 120),
+]
+BOILERPLATE = [
+    "ООО «Снегоход-Сервис», ИНН 7701234567, г. Москва, ул. Заводская, д. 1",
+    "Тел.: +7 (495) 123-45-67, e-mail: info@example.ru",
+    "Гарантийные обязательства изготовителя действуют при соблюдении правил эксплуатации.",
+]
+# prose the rule-based extractor leaves to the model, so the benchmark still measures the llm stage
+DESCRIPTION = [
+    "Снегоболотоход предназначен для круглогодичной эксплуатации в условиях бездорожья,",
+    "на заболоченной местности, в глубоком снегу и на мелководье. Машина оснащена",
+    "двигателем {engine} с системой предпускового подогрева и шинами сверхнизкого",
+    "давления размерности {tire}. Кабина рассчитана на {seats} человек, а отопитель",
+    "поддерживает в ней температуру до {temperature} градусов при морозе до минус {frost}.",
+]
+ENGINES = ["ЯМЗ-534", "Д-245", "Cummins ISF 2.8", "Kubota V3800"]
+TIRES = ["1300x700-21", "1200x600-21", "1650x700-25"]
+
+
+def description_lines(rng: random.Random) -> list:
+    text = "\n".join(DESCRIPTION).format(
+        engine=rng.choice(ENGINES), tire=rng.choice(TIRES), seats=rng.randint(2, 12),
+        temperature=rng.randint(15, 25), frost=rng.randint(40, 55),
+    )
+    return text.split("\n")
+
+
+def spec_sheet_lines(doc_no: int, pages: int) -> list:
+    rng = random.Random(doc_no)
+    lines = [f"ТЕХНИЧЕСКИЙ ПАСПОРТ № {doc_no}", f"Снегоболотоход модель СБХ-{rng.randint(100, 999)}", ""]
+    while len(lines) < pages * LINES_PER_PAGE:
+        for name, unit, low, high in FEATURES:
+            lines.append(f"{name}: {rng.randint(low, high)} {unit}")
+        lines.extend(BOILERPLATE)
+        lines.append("")
+        lines.extend(description_lines(rng))
+        lines.append("")
+    return lines[:pages * LINES_PER_PAGE]
+
+
+def write_born_digital(path: str, lines: list, font_path: str) -> None:
+    if "SpecFont" not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont("SpecFont", font_path))
+    pdf = canvas.Canvas(path, pagesize=A4)
+    width, height = A4
+    for start in range(0, len(lines), LINES_PER_PAGE):
+        pdf.setFont("SpecFont", 11)
+        y = height - 60
+        for line in lines[start:start + LINES_PER_PAGE]:
+            pdf.drawString(50, y, line)
+            y -= 18
+        pdf.showPage()
+    pdf.save()
+
+
+def write_scanned(path: str, lines: list, font_path: str, seed: int) -> None:
+    rng = random.Random(seed)
+    width, height = int(8.27 * SCAN_DPI), int(11.69 * SCAN_DPI)
+    font = ImageFont.truetype(font_path, int(11 * SCAN_DPI / 72))
+    images = []
+    for start in range(0, len(lines), LINES_PER_PAGE):
+        image = Image.new("L", (width, height), 255)
+        draw = ImageDraw.Draw(image)
+        y = int(60 * SCAN_DPI / 72)
+        for line in lines[start:start + LINES_PER_PAGE]:
+            draw.text((int(50 * SCAN_DPI / 72), y), line, font=font, fill=0)
+            y += int(18 * SCAN_DPI / 72)
+        # a slight skew and blur make the page look like a scan rather than a render
+        image = image.rotate(rng.uniform(-1.0, 1.0), fillcolor=255).filter(ImageFilter.GaussianBlur(0.6))
+        images.append(image.convert("RGB"))
+    images[0].save(path, save_all=True, append_images=images[1:], resolution=SCAN_DPI)
+
+
+def generate_corpus(directory: str, count: int, scanned_share: float, pages: int,
+                    font_path: str = DEFAULT_FONT) -> list:
+    os.makedirs(directory, exist_ok=True)
+    documents = []
+    for doc_no in range(count):
+        lines = spec_sheet_lines(doc_no, pages)
+        scanned = doc_no < round(count * scanned_share)
+        path = os.path.join(directory, f"{'scanned' if scanned else 'digital'}_{doc_no:04d}.pdf")
+        if not os.path.exists(path):
+            if scanned:
+                write_scanned(path, lines, font_path, doc_no)
+            else:
+                write_born_digital(path, lines, font_path)
+        documents.append((path, "scanned" if scanned else "digital"))
+    return documents
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate synthetic Russian spec-sheet PDFs.")
+    parser.add_argument("directory")
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--scanned-share", type=float, default=0.5)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--font", default=DEFAULT_FONT, help="TTF font with Cyrillic glyphs")
+    args = parser.parse_args()
+    for path, kind in generate_corpus(args.directory, args.count, args.scanned_share, args.pages, args.font):
+        print(kind, path)
+
+
+if __name__ == "__main__":
+    main()
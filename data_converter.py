@@ -1,7 +1,7 @@
-import os
 import ast
 import json
 import re
+from collections import Counter
 
 
 def parse_text_to_find_dict(text: str) -> str:
@@ -25,6 +25,8 @@ def dict_to_json(feature_dict: dict) -> str:
 
 
 def formatted_str(feature_dict: dict) -> str:
+    if not feature_dict:
+        return "{}"
     feature_text = "{\n"
     for key, value in feature_dict.items():
         if not isinstance(value, (list, dict)):
@@ -36,6 +38,386 @@ def formatted_str(feature_dict: dict) -> str:
     return feature_text
 
 
+class FeatureSet:
+    __slots__ = ("_features", "_keys", "_text", "_json")
+
+    def __init__(self, features: dict = None) -> None:
+        self._features = dict(features or {})
+        self._invalidate()
+
+    @classmethod
+    def from_text(cls, text: str) -> "FeatureSet":
+        return cls(text_to_dict(text))
+
+    def _invalidate(self) -> None:
+        self._keys = None
+        self._text = None
+        self._json = None
+
+    def __len__(self) -> int:
+        return len(self._features)
+
+    def __iter__(self):
+        return iter(self._features)
+
+    def __contains__(self, key) -> bool:
+        return key in self._features
+
+    def __getitem__(self, key):
+        return self._features[key]
+
+    def __setitem__(self, key, value) -> None:
+        self._features[key] = value
+        self._invalidate()
+
+    def __delitem__(self, key) -> None:
+        del self._features[key]
+        self._invalidate()
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, FeatureSet) and self._features == other._features
+
+    def __getstate__(self) -> dict:
+        # rendered views are rebuilt on demand instead of being persisted
+        return {"features": self._features}
+
+    def __setstate__(self, state: dict) -> None:
+        self._features = state["features"]
+        self._invalidate()
+
+    def get(self, key, default=None):
+        return self._features.get(key, default)
+
+    def keys(self):
+        return self._features.keys()
+
+    def items(self):
+        return self._features.items()
+
+    def key_at(self, index: int) -> str:
+        if self._keys is None:
+            self._keys = list(self._features)
+        return self._keys[index]
+
+    def replace(self, old_key, new_key, value) -> None:
+        if old_key != new_key:
+            del self._features[old_key]
+        self._features[new_key] = value
+        self._invalidate()
+
+    def copy(self) -> "FeatureSet":
+        return FeatureSet(self._features)
+
+    def to_dict(self) -> dict:
+        return dict(self._features)
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = formatted_str(self._features)
+        return self._text
+
+    @property
+    def json(self) -> str:
+        if self._json is None:
+            self._json = dict_to_json(self._features)
+        return self._json
+
+
+FEATURE_PAIR_PATTERN = re.compile(r"""['"]([^'"\n]+)['"]\s*:\s*['"]([^'"\n]*)['"]""")
+
+
+class StreamingFeatureParser:
+    def __init__(self) -> None:
+        self.features = {}
+        self._buffer = ""
+        self._position = 0
+
+    def feed(self, delta: str) -> list:
+        # returns the 'key': 'value' pairs completed by this delta
+        self._buffer += delta
+        start = self._buffer.find("{")
+        if start == -1:
+            return []
+        new_pairs = []
+        for match in FEATURE_PAIR_PATTERN.finditer(self._buffer, max(start, self._position)):
+            key, value = match.group(1).strip(), match.group(2).strip()
+            self.features[key] = value
+            new_pairs.append((key, value))
+            self._position = match.end()
+        return new_pairs
+
+
+def as_feature_set(features) -> FeatureSet:
+    # feature sets persisted before FeatureSet existed are stored as text
+    if isinstance(features, FeatureSet):
+        return features
+    return FeatureSet.from_text(features or "{}")
+
+
+def normalize_key(key: str) -> str:
+    key = str(key).lower().replace("ё", "е")
+    return " ".join(re.sub(r"[^\w\s]", " ", key).split())
+
+
+def _resolve_conflict(values: list):
+    if any(isinstance(value, list) for value in values):
+        merged = []
+        for value in values:
+            for item in (value if isinstance(value, list) else [value]):
+                if item not in merged:
+                    merged.append(item)
+        return merged
+
+    # the value most chunks agree on wins, the most detailed one breaks ties
+    values = [value.strip() if isinstance(value, str) else value for value in values]
+    counts = Counter(normalize_key(value) for value in values)
+    return max(values, key=lambda value: (counts[normalize_key(value)], len(str(value))))
+
+
+def merge_feature_dicts(feature_dicts: list) -> dict:
+    merged = {}
+    for feature_dict in feature_dicts:
+        for key, value in feature_dict.items():
+            norm_key = normalize_key(key)
+            if not norm_key or value in ("", None, [], {}):
+                continue
+            merged.setdefault(norm_key, (key, []))[1].append(value)
+    return {key: _resolve_conflict(values) for key, values in merged.values()}
+
+
+RUSSIAN_ENDINGS = sorted([
+    "ость", "ости", "ыми", "ими", "его", "ого", "ему", "ому", "ая", "яя", "ое", "ее", "ые", "ие", "ый", "ий",
+    "ой", "ую", "юю", "ам", "ям", "ах", "ях", "ов", "ев", "ей", "ом", "ем", "ию", "ия",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+], key=len, reverse=True)
+KEY_STOP_WORDS = {"в", "на", "для", "при", "с", "и", "не", "по", "до", "от"}
+KEY_SYNONYMS = {
+    "масса": "вес",
+    "снаряженная масса": "вес",
+    "габаритная длина": "длина",
+    "габаритная ширина": "ширина",
+    "габаритная высота": "высота",
+    "дорожный просвет": "клиренс",
+    "мощность двигателя": "мощность",
+    "максимальная мощность": "мощность",
+    "грузоподъемность": "грузоподъемность",
+    "полезная нагрузка": "грузоподъемность",
+    "максимальная скорость": "скорость",
+    "скорость на суше": "скорость",
+    "объем топливного бака": "топливный бак",
+    "емкость топливного бака": "топливный бак",
+    "количество мест": "пассажировместимость",
+    "число мест": "пассажировместимость",
+}
+
+# unit -> (base unit, factor to the base unit)
+UNITS = {
+    "мм": ("мм", 1), "см": ("мм", 10), "м": ("мм", 1000), "км": ("мм", 1000000),
+    "г": ("кг", 0.001), "кг": ("кг", 1), "т": ("кг", 1000),
+    "мл": ("л", 0.001), "л": ("л", 1), "м3": ("л", 1000),
+    "вт": ("вт", 1), "квт": ("вт", 1000), "л.с.": ("вт", 735.5),
+    "км/ч": ("км/ч", 1), "м/с": ("км/ч", 3.6),
+    "л/ч": ("л/ч", 1), "об/мин": ("об/мин", 1),
+    "с": ("с", 1), "мин": ("с", 60), "ч": ("с", 3600), "час": ("с", 3600), "часа": ("с", 3600),
+    "часов": ("с", 3600),
+    "в": ("в", 1), "а": ("а", 1), "а*ч": ("а*ч", 1), "ач": ("а*ч", 1),
+    "°": ("°", 1), "градусов": ("°", 1), "градуса": ("°", 1),
+    "%": ("%", 1),
+}
+KEY_UNIT_WORDS = {word for unit in UNITS for word in normalize_key(unit).split()}
+QUANTITY_PATTERN = re.compile(
+    r"(\d+(?:[.,]\d+)?)\s*(?:-|–|—|до)?\s*(\d+(?:[.,]\d+)?)?\s*"
+    r"(л\.с\.|км/ч|м/с|л/ч|об/мин|а\*ч|[a-zа-я°%]+\d?)?",
+    re.IGNORECASE,
+)
+
+
+def stem_word(word: str) -> str:
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def canonical_key(key: str) -> str:
+    # 'Длина, мм' and 'длина' are one property, 'Ширина колеи' and 'Ширина колеса' are two
+    words = normalize_key(key).split()
+    key = " ".join(word for word in words if word not in KEY_UNIT_WORDS) or " ".join(words)
+    key = KEY_SYNONYMS.get(key, key)
+    return " ".join(sorted({stem_word(word) for word in key.split() if word not in KEY_STOP_WORDS}))
+
+
+def value_to_str(value) -> str:
+    if isinstance(value, list):
+        return ", ".join(str(item) for item in value)
+    return str(value)
+
+
+def parse_unit(value: str) -> [tuple, None]:
+    # the unit of the first number in the value, e.g. '3500-3880 мм' -> ('мм', 'мм', 1)
+    match = QUANTITY_PATTERN.search(value.lower())
+    if match is None or match.group(3) is None or match.group(3) not in UNITS:
+        return None
+    unit = match.group(3)
+    return (unit,) + UNITS[unit]
+
+
+def convert_value(value: str, unit: str) -> str:
+    # rewrites every number with a known unit into the given unit of the same dimension
+    base, factor = UNITS[unit]
+
+    def replace(match):
+        source_unit = (match.group(3) or "").lower()
+        if source_unit not in UNITS or UNITS[source_unit][0] != base or source_unit == unit:
+            return match.group(0)
+        scale = UNITS[source_unit][1] / factor
+        numbers = [float(number.replace(",", ".")) * scale for number in match.group(1, 2) if number]
+        return "-".join(f"{round(number, 2):g}" for number in numbers) + f" {unit}"
+
+    return QUANTITY_PATTERN.sub(replace, value)
+
+
+def align_values(value_1, value_2) -> tuple:
+    value_1, value_2 = value_to_str(value_1), value_to_str(value_2)
+    unit_1, unit_2 = parse_unit(value_1), parse_unit(value_2)
+    if unit_1 and unit_2 and unit_1[1] == unit_2[1] and unit_1[0] != unit_2[0]:
+        value_2 = convert_value(value_2, unit_1[0])
+    return value_1, value_2
+
+
+LOWER_BOUND_WORDS = ("не менее", "не ниже", "не меньше", "более", "свыше", "больше", "от", "мин", "min")
+UPPER_BOUND_WORDS = ("не более", "не выше", "не больше", "менее", "меньше", "до", "макс", "max")
+NOT_UNITS = {"х", "x", "и", "или"}  # '1600 х 570 мм', '5 или 6'
+
+
+def parse_range(value) -> [tuple, None]:
+    # '3500-3880 мм' -> (3500.0, 3880.0, 'мм'), 'до 1000 кг' -> (-inf, 1000.0, 'кг'),
+    # 'не менее 40 л.с.' -> (29420.0, inf, 'вт'); numbers are converted to the base unit
+    if not isinstance(value, str):
+        return None
+    text = value.lower().strip()
+    match = QUANTITY_PATTERN.search(text)
+    if match is None:
+        return None
+    low = float(match.group(1).replace(",", "."))
+    high = float(match.group(2).replace(",", ".")) if match.group(2) else low
+    unit = match.group(3) or ""
+    if unit in UNITS:
+        base, factor = UNITS[unit]
+    elif unit in NOT_UNITS:
+        return None
+    elif unit.isalpha():
+        base, factor = stem_word(unit), 1
+    elif not unit:
+        base, factor = "", 1
+    else:
+        return None
+
+    prefix = text[:match.start()].strip(" .:")  # 'макс. 20 кг', 'не более: 5 т'
+    if match.group(2) is None:
+        # the longest phrase decides, 'не более' ends with the lower bound 'более'
+        bound = max((word for word in LOWER_BOUND_WORDS + UPPER_BOUND_WORDS if prefix.endswith(word)),
+                    key=len, default=None)
+        if bound in LOWER_BOUND_WORDS:
+            high = float("inf")
+        elif bound in UPPER_BOUND_WORDS:
+            low = float("-inf")
+    return min(low, high) * factor, max(low, high) * factor, base
+
+
+def compare_feature_sets(features_1, features_2, name_1: str = "товар 1", name_2: str = "товар 2") -> tuple:
+    # returns the comparison table lines and the features of both sets left unmatched
+    canonical_2 = {}
+    for key in features_2.keys():
+        canonical_2.setdefault(canonical_key(key), key)
+
+    matched = []
+    unmatched_1 = []
+    used_2 = set()
+    for key_1 in features_1.keys():
+        canonical_1 = canonical_key(key_1)
+        key_2 = canonical_2.get(canonical_1)
+        if key_2 is None or key_2 in used_2:
+            unmatched_1.append(key_1)
+            continue
+        used_2.add(key_2)
+        matched.append((key_1, key_2))
+
+    lines = [f"Свойство | {name_1} | {name_2}"]
+    for key_1, key_2 in matched:
+        value_1, value_2 = align_values(features_1[key_1], features_2[key_2])
+        lines.append(f"{key_1} | {value_1} | {value_2}")
+
+    residue_1 = {key: features_1[key] for key in unmatched_1}
+    residue_2 = {key: features_2[key] for key in features_2.keys() if key not in used_2}
+    return lines, residue_1, residue_2
+
+
+def compare_matrix(feature_sets: list, names: list) -> list:
+    # features present in at least two of the sets, values in the unit of the first set that has them
+    rows = {}
+    for column, features in enumerate(feature_sets):
+        for key in features.keys():
+            row = rows.setdefault(canonical_key(key), [key, [None] * len(feature_sets)])
+            if row[1][column] is None:
+                row[1][column] = value_to_str(features[key])
+
+    lines = ["Свойство | " + " | ".join(names)]
+    for key, values in rows.values():
+        present = [value for value in values if value is not None]
+        if len(present) < 2:
+            continue
+        unit = parse_unit(present[0])
+        if unit is not None:
+            values = [convert_value(value, unit[0]) if value is not None else None for value in values]
+        lines.append(f"{key} | " + " | ".join(value if value is not None else "—" for value in values))
+    return lines
+
+
+PATCH_LINE_PATTERN = re.compile(
+    r"""^[\s\-*•]*(ADD|CHANGE|DELETE)\s+['"]?([^:'"\n]+?)['"]?\s*(?::\s*(.*?))?\s*$""",
+    re.MULTILINE | re.IGNORECASE,
+)
+
+
+def parse_patch(text: str) -> list:
+    # 'ADD key: value', 'CHANGE key: value' and 'DELETE key' lines, anything else is ignored
+    operations = []
+    for operation, key, value in PATCH_LINE_PATTERN.findall(text):
+        operation = operation.upper()
+        if operation != "DELETE" and not value:
+            continue
+        operations.append((operation, key.strip(), value.strip().strip("'\",") if operation != "DELETE" else None))
+    return operations
+
+
+def format_patch(operations: list) -> str:
+    return "\n".join(f"{operation} {key}" if operation == "DELETE" else f"{operation} {key}: {value}"
+                     for operation, key, value in operations)
+
+
+def apply_patch(features, operations: list) -> FeatureSet:
+    # keys are matched like in compare_feature_sets, the model does not always repeat them verbatim
+    patched = as_feature_set(features).copy()
+    canonical = {}
+    for key in patched.keys():
+        canonical.setdefault(canonical_key(key), key)
+    for operation, key, value in operations:
+        existing = key if key in patched else canonical.get(canonical_key(key))
+        if existing is not None and existing not in patched:
+            existing = None
+        if operation == "DELETE":
+            if existing is not None:
+                del patched[existing]
+        elif existing is not None:
+            patched[existing] = value
+        else:
+            patched[key] = value
+            canonical.setdefault(canonical_key(key), key)
+    return patched
+
+
 def delete_postfix(text: str) -> str:
     text_without_postfix = re.findall(r'(.+)_', text)[0]
     return text_without_postfix
@@ -51,16 +433,6 @@ def parse_value(text: str) -> str:
     return text_value
 
 
-def create_folders() -> None:
-    dir_m = os.getcwd()
-    input_path = os.path.join(dir_m, "input-pdfs")
-    temp_path = os.path.join(dir_m, "temp")
-
-    for folder in [input_path, temp_path]:
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-
-
 def main() -> None:
     pass
 
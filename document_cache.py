@@ -0,0 +1,126 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+
+DOCUMENT_CACHE_PATH = ".hackatton_document_cache"
+DOCUMENT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+DOCUMENT_CACHE_VERSION = "2"  # bump when ocr.py changes the extracted text to invalidate cached documents
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def bytes_sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class DocumentCache:
+    def __init__(self, path: str = DOCUMENT_CACHE_PATH, max_bytes: int = DOCUMENT_CACHE_MAX_BYTES,
+                 version: str = DOCUMENT_CACHE_VERSION) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.version = version
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("PRAGMA foreign_keys = ON")
+            self._connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    sha256 TEXT PRIMARY KEY,
+                    pages TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS documents_last_access ON documents (last_access);
+                CREATE TABLE IF NOT EXISTS file_ids (
+                    file_unique_id TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL REFERENCES documents (sha256) ON DELETE CASCADE
+                );
+                """
+            )
+        return self._connection
+
+    def _key(self, sha256: str) -> str:
+        # entries of older versions are never read again and leave with the eviction
+        return f"{self.version}:{sha256}"
+
+    def _get(self, key: str) -> [list, None]:
+        connection = self._connect()
+        row = connection.execute("SELECT pages FROM documents WHERE sha256 = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with connection:
+            connection.execute("UPDATE documents SET last_access = ? WHERE sha256 = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def get(self, sha256: str) -> [list, None]:
+        return self._get(self._key(sha256))
+
+    def get_by_file_id(self, file_unique_id: str) -> [list, None]:
+        row = self._connect().execute(
+            "SELECT sha256 FROM file_ids WHERE file_unique_id = ?", (file_unique_id,)
+        ).fetchone()
+        if row is None or not row[0].startswith(self._key("")):
+            return None
+        return self._get(row[0])
+
+    def add_file_id(self, file_unique_id: str, sha256: str) -> None:
+        connection = self._connect()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO file_ids (file_unique_id, sha256) VALUES (?, ?)",
+                               (file_unique_id, self._key(sha256)))
+
+    def put(self, sha256: str, pages: list, file_unique_id: str = None) -> None:
+        data = json.dumps(pages, ensure_ascii=False)
+        connection = self._connect()
+        with connection:
+            # an upsert keeps the row, REPLACE would delete it and cascade to the file_ids pointing at it
+            connection.execute(
+                "INSERT INTO documents (sha256, pages, size, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (sha256) DO UPDATE SET "
+                "pages = excluded.pages, size = excluded.size, last_access = excluded.last_access",
+                (self._key(sha256), data, len(data.encode()), time.time())
+            )
+        if file_unique_id is not None:
+            self.add_file_id(file_unique_id, sha256)
+        self._evict()
+
+    def _evict(self) -> None:
+        connection = self._connect()
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for sha256, size in connection.execute("SELECT sha256, size FROM documents ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((sha256,))
+            total -= size
+        with connection:
+            connection.executemany("DELETE FROM documents WHERE sha256 = ?", evicted)
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+document_cache = DocumentCache()
+
+
+def main() -> None:
+    pass
+
+
+if __name__ == "__main__":
+    main()
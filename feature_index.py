@@ -0,0 +1,134 @@
+import re
+from collections import Counter
+
+import numpy as np
+
+from data_converter import UNITS, canonical_key, parse_range, parse_unit
+
+
+SEARCH_UNITS = "|".join(re.escape(unit) for unit in sorted(UNITS, key=len, reverse=True))
+SEARCH_CONDITION_PATTERN = re.compile(
+    r"([^<>=\d]+?)\s*(>=|<=|>|<|=)\s*(\d+(?:[.,]\d+)?)\s*"
+    # only a known unit, and not when it is the key of the next condition
+    rf"((?:{SEARCH_UNITS})(?=\s|$|[,;])(?!\s*[<>=]))?",
+    re.IGNORECASE,
+)
+
+
+def parse_search_query(query: str) -> list:
+    # 'Грузоподъемность>=800 Клиренс>=60 см' -> [(key, op, number, unit), ...]
+    conditions = []
+    for match in SEARCH_CONDITION_PATTERN.finditer(query):
+        key, op, number, unit = match.groups()
+        conditions.append((key.strip(" ,;"), op, float(number.replace(",", ".")), (unit or "").lower()))
+    return conditions
+
+
+class _Column:
+    __slots__ = ("rows", "mins", "maxs", "units", "arrays")
+
+    def __init__(self) -> None:
+        self.rows = []
+        self.mins = []
+        self.maxs = []
+        self.units = Counter()
+        self.arrays = None
+
+
+class FeatureIndex:
+    def __init__(self) -> None:
+        self._entries = []
+        self._positions = {}
+        self._owners = {}
+        self._alive = []
+        self._columns = {}
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def add(self, owner, name: str, features) -> None:
+        self.remove(owner, name)
+        row = len(self._entries)
+        self._entries.append((owner, name))
+        self._alive.append(True)
+        self._positions[(owner, name)] = row
+        self._owners.setdefault(owner, set()).add(name)
+
+        for key, value in features.items():
+            parsed = parse_range(value)
+            if parsed is None:
+                continue
+            low, high, base = parsed
+            column = self._columns.setdefault((canonical_key(key), base), _Column())
+            column.rows.append(row)
+            column.mins.append(low)
+            column.maxs.append(high)
+            unit = parse_unit(value)
+            column.units[unit[0] if unit else base] += 1
+            column.arrays = None
+
+    def remove(self, owner, name: str) -> None:
+        row = self._positions.pop((owner, name), None)
+        if row is not None:
+            self._alive[row] = False
+            self._owners[owner].discard(name)
+
+    def remove_owner(self, owner) -> None:
+        for name in list(self._owners.pop(owner, ())):
+            self._alive[self._positions.pop((owner, name))] = False
+
+    def _arrays(self, column: _Column) -> tuple:
+        if column.arrays is None:
+            column.arrays = (np.array(column.rows, dtype=np.int64),
+                             np.array(column.mins, dtype=np.float64),
+                             np.array(column.maxs, dtype=np.float64))
+        return column.arrays
+
+    def _match(self, key: str, op: str, number: float, unit: str) -> np.ndarray:
+        rows = []
+        for (column_key, base), column in self._columns.items():
+            if column_key != key:
+                continue
+            if unit in UNITS:
+                if UNITS[unit][0] != base:
+                    continue
+                value = number * UNITS[unit][1]
+            else:
+                # no unit in the query: the unit most documents use for this feature
+                display_unit = column.units.most_common(1)[0][0]
+                value = number * (UNITS[display_unit][1] if display_unit in UNITS else 1)
+
+            column_rows, mins, maxs = self._arrays(column)
+            # a feature matches when its [min, max] range can satisfy the condition
+            if op == ">=":
+                mask = maxs >= value
+            elif op == ">":
+                mask = maxs > value
+            elif op == "<=":
+                mask = mins <= value
+            elif op == "<":
+                mask = mins < value
+            else:
+                mask = (mins <= value) & (value <= maxs)
+            rows.append(column_rows[mask])
+        if not rows:
+            return np.array([], dtype=np.int64)
+        return np.unique(np.concatenate(rows))
+
+    def search(self, conditions: list) -> list:
+        matched = None
+        for key, op, number, unit in conditions:
+            rows = self._match(canonical_key(key), op, number, unit)
+            matched = rows if matched is None else np.intersect1d(matched, rows, assume_unique=True)
+        if matched is None:
+            return []
+        alive = np.array(self._alive, dtype=bool)
+        return [self._entries[row] for row in matched[alive[matched]]]
+
+
+def main() -> None:
+    pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+
+
+LLM_CACHE_PATH = ".hackatton_llm_cache"
+LLM_CACHE_TTL = 30 * 24 * 60 * 60  # seconds
+LLM_CACHE_MAX_ENTRIES = 20000
+LLM_CACHE_MEMORY_ENTRIES = 512
+
+
+def normalize_input(text: str) -> str:
+    return " ".join(text.split())
+
+
+def make_key(model: str, prompt_version: str, *parts) -> str:
+    normalized = [normalize_input(part) if isinstance(part, str) else part for part in parts]
+    data = json.dumps([model, prompt_version, normalized], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES, memory_entries: int = LLM_CACHE_MEMORY_ENTRIES) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            self._connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS completions (
+                    key TEXT PRIMARY KEY,
+                    content TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access);
+                """
+            )
+        return self._connection
+
+    def _remember(self, key: str, content: str, expires_at: float) -> None:
+        self._memory[key] = (content, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> [str, None]:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None and entry[1] > now:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        connection = self._connect()
+        row = connection.execute("SELECT content, expires_at FROM completions WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= now:
+            self._memory.pop(key, None)
+            self.misses += 1
+            return None
+
+        with connection:
+            connection.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+        self._remember(key, row[0], row[1])
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, content: str) -> None:
+        now = time.time()
+        expires_at = now + self.ttl
+        self._remember(key, content, expires_at)
+
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO completions (key, content, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, content, expires_at, now)
+            )
+            connection.execute("DELETE FROM completions WHERE expires_at <= ?", (now,))
+            connection.execute(
+                "DELETE FROM completions WHERE key IN "
+                "(SELECT key FROM completions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def delete(self, key: str) -> None:
+        self._memory.pop(key, None)
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+llm_cache = LLMCache()
+
+
+def main() -> None:
+    pass
+
+
+if __name__ == "__main__":
+    main()
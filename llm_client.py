@@ -0,0 +1,189 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+from openai import APIConnectionError, APITimeoutError, AsyncOpenAI, InternalServerError, RateLimitError
+
+from metrics import log_event, registry, span
+
+
+LLM_MAX_CONCURRENCY = 8
+LLM_REQUESTS_PER_MINUTE = 60
+LLM_MAX_RETRIES = 5
+LLM_MAX_CONNECTIONS = 20
+LLM_REQUEST_TIMEOUT = 120  # seconds
+BACKOFF_BASE = 1.0  # seconds
+BACKOFF_MAX = 60.0  # seconds
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    # exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after(error: RateLimitError) -> [float, None]:
+    headers = error.response.headers
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def record_usage(model: str, usage) -> None:
+    if usage is None:
+        return
+    registry.inc("llm_tokens_total", usage.prompt_tokens, model=model, kind="prompt")
+    registry.inc("llm_tokens_total", usage.completion_tokens, model=model, kind="completion")
+    log_event("llm_usage", model=model, prompt_tokens=usage.prompt_tokens,
+              completion_tokens=usage.completion_tokens)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: float = None) -> None:
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate * 10)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def pause(self, seconds: float) -> None:
+        # a 429 stops every caller, not only the one that received it
+        now = time.monotonic()
+        self._refill(now)
+        self._tokens = 0.0
+        self._paused_until = max(self._paused_until, now + seconds)
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class LLMClient:
+    def __init__(self, api_key: str, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 requests_per_minute: float = LLM_REQUESTS_PER_MINUTE, max_retries: int = LLM_MAX_RETRIES,
+                 base_url: str = None) -> None:
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(requests_per_minute)
+        self.retries = 0
+        self._client = None
+        self._semaphore = None
+
+    def _get_client(self) -> AsyncOpenAI:
+        if self._client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                    max_keepalive_connections=LLM_MAX_CONNECTIONS),
+                timeout=LLM_REQUEST_TIMEOUT,
+            )
+            # retries are scheduled here, not inside the SDK
+            self._client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http_client,
+                                       max_retries=0)
+        return self._client
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def set_max_concurrency(self, max_concurrency: int) -> None:
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+    async def chat(self, model: str, messages: list) -> str:
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            async with self._get_semaphore():
+                try:
+                    with span("llm_request", model=model):
+                        completion = await self._get_client().chat.completions.create(model=model,
+                                                                                      messages=messages)
+                    record_usage(model, completion.usage)
+                    return completion.choices[0].message.content
+                except RateLimitError as e:
+                    if e.code == "insufficient_quota" or attempt == self.max_retries:
+                        raise
+                    delay = retry_after(e)
+                    if delay is None:
+                        delay = backoff_delay(attempt)
+                    self.bucket.pause(delay)
+                except (APIConnectionError, APITimeoutError, InternalServerError):
+                    if attempt == self.max_retries:
+                        raise
+                    delay = backoff_delay(attempt)
+            self.retries += 1
+            log_event("llm_retry", model=model, attempt=attempt + 1, delay=round(delay, 2))
+            await asyncio.sleep(delay)
+
+    async def stream_chat(self, model: str, messages: list):
+        # yields content deltas; a failed request is retried only until the first delta arrives
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            received = False
+            async with self._get_semaphore():
+                try:
+                    with span("llm_stream", model=model):
+                        stream = await self._get_client().chat.completions.create(
+                            model=model, messages=messages, stream=True, stream_options={"include_usage": True})
+                        async for chunk in stream:
+                            if chunk.usage is not None:
+                                record_usage(model, chunk.usage)
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                received = True
+                                yield chunk.choices[0].delta.content
+                    return
+                except RateLimitError as e:
+                    if received or e.code == "insufficient_quota" or attempt == self.max_retries:
+                        raise
+                    delay = retry_after(e)
+                    if delay is None:
+                        delay = backoff_delay(attempt)
+                    self.bucket.pause(delay)
+                except (APIConnectionError, APITimeoutError, InternalServerError):
+                    if received or attempt == self.max_retries:
+                        raise
+                    delay = backoff_delay(attempt)
+            self.retries += 1
+            log_event("llm_retry", model=model, attempt=attempt + 1, delay=round(delay, 2))
+            await asyncio.sleep(delay)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+def main() -> None:
+    pass
+
+
+if __name__ == "__main__":
+    main()
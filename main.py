@@ -1,9 +1,12 @@
+import asyncio
 import logging
+import time
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     Update,
 )
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import (
     Application,
     CallbackContext,
@@ -12,22 +15,31 @@ from telegram.ext import (
     ContextTypes,
     ConversationHandler,
     MessageHandler,
-    PicklePersistence,
     filters,
 )
 from io import BytesIO
 
-from ocr import extract_text
-from post_processing import compare_features, generate_response, make_direct_prompt
+from feature_index import FeatureIndex, parse_search_query
+from document_cache import bytes_sha256, document_cache
+from llm_cache import llm_cache
+from metrics import log_event, registry, span, start_metrics_server
+from ocr import PAGE_SEPARATOR
+from ocr_executor import OcrTimeoutError, ocr_executor
+from llm_client import TokenBucket
+from post_processing import DocumentExtraction, compact_history, compare_features, llm_client, refine_features
 from data_converter import (
-    create_folders,
+    FeatureSet,
+    as_feature_set,
+    compare_feature_sets,
+    compare_matrix,
     delete_postfix,
-    dict_to_json,
+    format_patch,
     formatted_str,
     parse_key,
     parse_value,
-    text_to_dict,
 )
+from sqlite_persistence import SQLitePersistence
+from update_processor import PerChatUpdateProcessor
 from config import TOKEN
 
 
@@ -40,6 +52,92 @@ logger = logging.getLogger(__name__)
 
 MAX_MESSAGE_LENGTH = 4096  # no more than 4096
 NUMBER_OF_ATTEMPTS = 5
+MAX_SEARCH_RESULTS = 30
+PROGRESS_EDIT_INTERVAL = 1.5  # seconds, Telegram rejects more frequent edits of one message
+EDITOR_PAGE_SIZE = 8
+DELETE_BATCH_SIZE = 100  # the limit of deleteMessages
+DELETE_CONCURRENCY = 8
+TELEGRAM_REQUESTS_PER_MINUTE = 1200
+
+telegram_bucket = TokenBucket(TELEGRAM_REQUESTS_PER_MINUTE)
+
+
+class ProgressMessage:
+    def __init__(self, message, header: str) -> None:
+        self.message = message
+        self.header = header
+        self._next_edit = 0.0
+
+    async def _edit(self, text: str) -> None:
+        try:
+            await self.message.edit_text(text[:MAX_MESSAGE_LENGTH])
+        except RetryAfter as e:
+            self._next_edit = time.monotonic() + e.retry_after
+        except TelegramError as e:
+            # progress is cosmetic, a failed edit must not abort the document
+            logger.warning("Error editing progress message: %s", e)
+
+    async def report(self, text: str) -> None:
+        # intermediate states are dropped while throttled, the final one is sent by finish
+        now = time.monotonic()
+        if now < self._next_edit:
+            return
+        self._next_edit = now + PROGRESS_EDIT_INTERVAL
+        await self._edit(f"{self.header}\n{text}")
+
+    async def update(self, features: FeatureSet) -> None:
+        await self.report(features.text)
+
+    async def finish(self, text: str) -> None:
+        delay = self._next_edit - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._edit(text)
+
+
+feature_index = FeatureIndex()
+feature_index_version = None
+feature_index_change = None
+
+
+def index_saved_features(user_id: int, user_data: dict) -> None:
+    feature_index.remove_owner(user_id)
+    for name, features in user_data.get("saved_features", {}).items():
+        feature_index.add(user_id, name, as_feature_set(features))
+
+
+async def get_feature_index(context: ContextTypes.DEFAULT_TYPE) -> FeatureIndex:
+    # built from the store once, afterwards only the users another worker process has written are re-read;
+    # sets saved in this process are added by handle_name_input
+    global feature_index_version, feature_index_change
+    persistence = context.application.persistence
+    version = persistence.data_version()
+    if version == feature_index_version:
+        return feature_index
+    if feature_index_change is None:
+        # sets saved in this process are written out first, the build reads only the store
+        await context.application.update_persistence()
+        feature_index_change = persistence.last_user_change()
+        for user_id, user_data in persistence.read_user_data().items():
+            index_saved_features(user_id, user_data)
+    else:
+        feature_index_change, changed = persistence.read_changed_user_data(feature_index_change)
+        for user_id, user_data in changed.items():
+            if user_data is None:
+                feature_index.remove_owner(user_id)
+            else:
+                index_saved_features(user_id, user_data)
+    feature_index_version = version
+    return feature_index
+
+
+def get_feature_set(context: ContextTypes.DEFAULT_TYPE) -> FeatureSet:
+    features = context.user_data.get("features")
+    if features is None:
+        features = as_feature_set(context.user_data.pop("feature_txt", "{}"))
+        context.user_data["features"] = features
+    return features
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
@@ -50,29 +148,97 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     document = update.message.document
-    create_folders()
     if document.mime_type == 'application/pdf':
-        file = await context.bot.get_file(document.file_id)
-        await file.download_to_drive("input-pdfs/{}".format(document.file_name))
-        await update.message.reply_text("PDF-файл успешно скачан! Идет обработка, подождите немного.")
-
-        text = extract_text(document.file_name)
-        context.user_data["initial_prompt_txt"] = text
-        for it in range(NUMBER_OF_ATTEMPTS):
-            pp_text = generate_response(text)
+        with span("handle_document"):
+            await process_document(update, context, document)
+    else:
+        await update.message.reply_text("Это не PDF-файл, на данный момент я работаю только с PDF.")
+
+
+async def process_document(update: Update, context: ContextTypes.DEFAULT_TYPE, document) -> None:
+    extraction = DocumentExtraction()
+    try:
+        await extract_document(update, context, document, extraction)
+    finally:
+        # chunks still with the model when the document is abandoned
+        extraction.cancel()
+
+
+async def extract_document(update: Update, context: ContextTypes.DEFAULT_TYPE, document,
+                           extraction: DocumentExtraction) -> None:
+    pages = document_cache.get_by_file_id(document.file_unique_id)
+    if pages is None:
+        with span("download"):
+            file = await context.bot.get_file(document.file_id)
+            buffer = BytesIO()
+            await file.download_to_memory(buffer)
+            data = buffer.getvalue()
+        with span("telegram_reply"):
+            status_message = await update.message.reply_text(
+                "PDF-файл успешно скачан! Идет обработка, подождите немного.")
+
+        digest = bytes_sha256(data)
+        pages = document_cache.get(digest)
+        if pages is None:
+            registry.inc("document_cache_requests_total", result="miss")
             try:
-                test_dict = text_to_dict(pp_text)
-                context.user_data["feature_txt"] = pp_text
-                await specify_output(update, context)
-                break
-            except Exception as e:
-                print(f"Attempt {it + 1} failed. Error: {e}")
-                print(f"Source text: {pp_text}")
+                # pages arrive in order while later ranges are still being recognized
+                ocr_progress = ProgressMessage(status_message, "PDF-файл успешно скачан! Идет распознавание.")
+                pages = []
+                with span("ocr"):
+                    async for page_no, page_text in ocr_executor.iter_pages(data):
+                        pages.append(page_text)
+                        # full chunks go to the model while the later pages are still recognized
+                        extraction.add_page(page_text)
+                        await ocr_progress.report(f"Готово страниц: {page_no}")
+            except OcrTimeoutError as e:
+                log_event("ocr_timeout", file_unique_id=document.file_unique_id, error=str(e))
+                await update.message.reply_text("Не удалось распознать документ за отведенное время.")
+                return
+            document_cache.put(digest, pages, file_unique_id=document.file_unique_id)
         else:
-            print("All attempts failed. Can't get a good answer.")
+            registry.inc("document_cache_requests_total", result="hit_sha256")
+            document_cache.add_file_id(document.file_unique_id, digest)
+    else:
+        registry.inc("document_cache_requests_total", result="hit_file_id")
+        with span("telegram_reply"):
+            status_message = await update.message.reply_text(
+                "Этот PDF-файл уже был распознан! Идет обработка, подождите немного.")
+
+    if not extraction.pages:
+        # cached documents start the extraction here, recognized ones during OCR
+        for page_text in pages:
+            extraction.add_page(page_text)
+    text = PAGE_SEPARATOR.join(pages)
+    context.user_data["initial_prompt_txt"] = text
+    progress = ProgressMessage(status_message, "Идет обработка, найденные характеристики:")
+    for it in range(NUMBER_OF_ATTEMPTS):
+        try:
+            if it:
+                # chunks that parsed are cached, a retry only asks the model for the failed ones
+                extraction = DocumentExtraction(pages)
+            with span("llm_extraction", attempt=it + 1):
+                features = await extraction.finish(on_progress=progress.update)
+        except (SyntaxError, TypeError, ValueError) as e:
+            # an answer that does not parse is worth another completion,
+            # API errors were already retried by llm_client and are not retried again here
+            registry.inc("extraction_attempts_total", outcome="failed")
+            log_event("extraction_attempt_failed", attempt=it + 1, error=str(e))
+            continue
+        except Exception as e:
+            registry.inc("extraction_attempts_total", outcome="error")
+            log_event("extraction_failed", attempts=it + 1, error=str(e))
             await update.message.reply_text("Возникла непредвиденная ошибка.")
+            return
+        registry.inc("extraction_attempts_total", outcome="ok")
+        context.user_data["features"] = features
+        with span("telegram_reply"):
+            await progress.finish(f"Обработка завершена, найдено характеристик: {len(features)}.")
+            await specify_output(update, context)
+        break
     else:
-        await update.message.reply_text("Это не PDF-файл, на данный момент я работаю только с PDF.")
+        log_event("extraction_failed", attempts=NUMBER_OF_ATTEMPTS)
+        await update.message.reply_text("Возникла непредвиденная ошибка.")
 
 
 async def test(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -117,14 +283,12 @@ async def test(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 }
     """
     context.user_data["initial_prompt_txt"] = data
-    context.user_data["feature_txt"] = data
+    context.user_data["features"] = FeatureSet.from_text(data)
     await specify_output(update, context)
 
 
 async def specify_output(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await delete_queries(update, context, q_type="output_queries")
-    await delete_queries(update, context, q_type="name_queries")
-    await delete_queries(update, context, q_type="items_queries")
+    await delete_queries(update, context, "output_queries", "name_queries", "items_queries")
     context.user_data["assistant_messages_history"] = []
 
     keyboard = [
@@ -152,31 +316,20 @@ async def output_button_handler(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
 
-    pp_text = context.user_data.get("feature_txt", "{}")
-    feature_dict = text_to_dict(pp_text)
+    features = get_feature_set(context)
 
     if query.data == "json":
-        features_json = dict_to_json(feature_dict)
-        await query.message.reply_document(document=BytesIO(features_json.encode()), filename="data.json")
+        await query.message.reply_document(document=BytesIO(features.json.encode()), filename="data.json")
     elif query.data == "message":
+        pp_text = features.text
         text_chunks = [pp_text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(pp_text), MAX_MESSAGE_LENGTH)]
         for text_chunk in text_chunks:
             await query.message.reply_text(text_chunk)
     elif query.data == "edit":
-        await delete_queries(query, context, q_type="items_queries")
-        for key, value in feature_dict.items():
-            message = f"{key}: {value}"
-            keyboard = [
-                [
-                    InlineKeyboardButton("Редактировать", callback_data="edit_item"),
-                    InlineKeyboardButton("Удалить", callback_data="delete_item")
-                ],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            sent_message = await query.message.reply_text(message, reply_markup=reply_markup)
-
-            context.user_data["items_queries"].append(sent_message.message_id)
-        await query.message.reply_text("Чтобы прекратить редактирование, введите /stop.")
+        await delete_queries(query, context, "items_queries")
+        text, reply_markup = render_editor(features, 0)
+        sent_message = await query.message.reply_text(text, reply_markup=reply_markup)
+        context.user_data["items_queries"].append(sent_message.message_id)
     elif query.data == "save":
         await query.message.reply_text("Введите имя для сохранения или отмените сохранение с помощью /cancel:")
         return "AWAITING_NAME"
@@ -184,40 +337,94 @@ async def output_button_handler(update: Update, context: ContextTypes.DEFAULT_TY
         await query.message.delete()
 
 
+def render_editor(features: FeatureSet, page: int) -> tuple:
+    # one message for the whole set, the buttons refer to features by their index
+    pages = max(1, -(-len(features) // EDITOR_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    first = page * EDITOR_PAGE_SIZE
+    last = min(first + EDITOR_PAGE_SIZE, len(features))
+
+    lines = [f"{index + 1}. {features.key_at(index)}: {features[features.key_at(index)]}"
+             for index in range(first, last)]
+    lines.append("")
+    lines.append("Чтобы прекратить редактирование, введите /stop.")
+
+    keyboard = [
+        [
+            InlineKeyboardButton(f"Редактировать {index + 1}", callback_data=f"edit_item_{index}_{page}"),
+            InlineKeyboardButton(f"Удалить {index + 1}", callback_data=f"delete_item_{index}_{page}"),
+        ]
+        for index in range(first, last)
+    ]
+    if pages > 1:
+        keyboard.append([
+            InlineKeyboardButton("<", callback_data=f"editor_page_{(page - 1) % pages}"),
+            InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"editor_page_{page}"),
+            InlineKeyboardButton(">", callback_data=f"editor_page_{(page + 1) % pages}"),
+        ])
+    return "\n".join(lines)[:MAX_MESSAGE_LENGTH], InlineKeyboardMarkup(keyboard)
+
+
+async def show_editor_page(message, features: FeatureSet, page: int) -> None:
+    text, reply_markup = render_editor(features, page)
+    try:
+        await message.edit_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        # pressing the current page again leaves the message unchanged
+        if "not modified" not in str(e):
+            raise
+
+
 async def items_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> [None, str]:
     query = update.callback_query
     await query.answer()
 
-    pp_text = context.user_data.get("feature_txt", "{}")
-    feature_dict = text_to_dict(pp_text)
-    key = parse_key(query.message.text)
+    features = get_feature_set(context)
+    action, index, page = query.data.rsplit("_", 2)
+    index, page = int(index), int(page)
+    if index >= len(features):
+        # the button belongs to an outdated page
+        await show_editor_page(query.message, features, page)
+        return
 
-    if query.data == "edit_item":
+    if action == "edit_item":
         await query.message.reply_text("Введите новое значение для фичи в формате "
                                        "key: value или отмените ввод с помощью /cancel:")
-        context.user_data["temp_query"] = query
+        context.user_data["edited_item"] = {"index": index, "page": page, "message_id": query.message.message_id}
         return "AWAITING_FEATURE_EDIT"
-    elif query.data == "delete_item":
-        del feature_dict[key]
-        context.user_data["feature_txt"] = formatted_str(feature_dict)
-        await query.message.delete()
+    elif action == "delete_item":
+        del features[features.key_at(index)]
+        await show_editor_page(query.message, features, page)
+
+
+async def editor_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+    await show_editor_page(query.message, get_feature_set(context), int(query.data.rsplit("_", 1)[1]))
 
 
 async def experimental_chatting(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     prompt = update.message.text
     if prompt != "/experiment":
-        if not context.user_data.get("assistant_messages_history", []):
-            context.user_data["assistant_messages_history"] = [
-                {"role": "assistant", "content": context.user_data.get("feature_txt")}
-            ]
-        context.user_data["assistant_messages_history"].append({"role": "user", "content": prompt})
-
-        pp_text, assistant_answer = make_direct_prompt(prompt, context.user_data.get("initial_prompt_txt"),
-                                                       context.user_data.get("assistant_messages_history"))
-        context.user_data["assistant_messages_history"].append({"role": "assistant", "content": assistant_answer})
-
-        context.user_data["feature_txt"] = pp_text
-        text_chunks = [pp_text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(assistant_answer), MAX_MESSAGE_LENGTH)]
+        history = context.user_data.get("assistant_messages_history", [])
+
+        status_message = await update.message.reply_text("Запрос принят, идет обработка.")
+        progress = ProgressMessage(status_message, "Идет обработка, текущие характеристики:")
+        with span("llm_chat"):
+            features, operations = await refine_features(prompt, get_feature_set(context),
+                                                         context.user_data.get("initial_prompt_txt"), history,
+                                                         on_progress=progress.update)
+        await progress.finish(f"Обработка завершена, изменений: {len(operations)}, "
+                              f"характеристик: {len(features)}.")
+        # only the patch is remembered, and the history is kept within its token budget
+        context.user_data["assistant_messages_history"] = compact_history(history + [
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": format_patch(operations)},
+        ])
+
+        context.user_data["features"] = features
+        pp_text = features.text
+        text_chunks = [pp_text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(pp_text), MAX_MESSAGE_LENGTH)]
         for text_chunk in text_chunks:
             await update.message.reply_text(text_chunk)
     else:
@@ -227,10 +434,11 @@ async def experimental_chatting(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def handle_name_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     name = update.message.text
-    feature_dict = context.user_data.get("feature_txt")
+    features = get_feature_set(context)
     if "saved_features" not in context.user_data:
         context.user_data["saved_features"] = {}
-    context.user_data["saved_features"][name] = feature_dict
+    context.user_data["saved_features"][name] = features.copy()
+    (await get_feature_index(context)).add(update.effective_user.id, name, features)
     await update.message.reply_text(f"Набор фич сохранен под именем: {name}")
     return ConversationHandler.END
 
@@ -240,33 +448,25 @@ async def handle_feature_edit(update: Update, context: ContextTypes.DEFAULT_TYPE
     key_new = parse_key(text)
     value = parse_value(text)
 
-    query = context.user_data.get("temp_query")
-
-    pp_text = context.user_data.get("feature_txt", "{}")
-    feature_dict = text_to_dict(pp_text)
-    key = parse_key(query.message.text)
-    del feature_dict[key]
-
-    feature_dict[key_new] = value
-
-    keyboard = [
-        [
-            InlineKeyboardButton("Редактировать", callback_data="edit_item"),
-            InlineKeyboardButton("Удалить", callback_data="delete_item")
-        ],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    context.user_data["feature_txt"] = formatted_str(feature_dict)
-    await query.message.edit_text(f"{text}", reply_markup=reply_markup)
+    edited_item = context.user_data.pop("edited_item", None)
+    features = get_feature_set(context)
+    if edited_item is None or edited_item["index"] >= len(features):
+        await update.message.reply_text("Фича для редактирования не найдена, откройте редактор заново.")
+        return ConversationHandler.END
+    features.replace(features.key_at(edited_item["index"]), key_new, value)
+
+    text, reply_markup = render_editor(features, edited_item["page"])
+    try:
+        await context.bot.edit_message_text(text, chat_id=update.effective_chat.id,
+                                            message_id=edited_item["message_id"], reply_markup=reply_markup)
+    except BadRequest as e:
+        logger.warning("Error editing feature editor: %s", e)
     await update.message.reply_text("Фича успешно отредактирована!")
     return ConversationHandler.END
 
 
 async def list_of_saved_features(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await delete_queries(update, context, q_type="output_queries")
-    await delete_queries(update, context, q_type="name_queries")
-    await delete_queries(update, context, q_type="items_queries")
+    await delete_queries(update, context, "output_queries", "name_queries", "items_queries")
 
     if "saved_features" not in context.user_data:
         context.user_data["saved_features"] = {}
@@ -284,32 +484,100 @@ async def choose_features_data(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     await query.answer()
 
-    context.user_data["feature_txt"] = context.user_data["saved_features"][delete_postfix(query.data)]
+    saved = as_feature_set(context.user_data["saved_features"][delete_postfix(query.data)])
+    context.user_data["features"] = saved.copy()
     await specify_output(query, context)
 
 
 async def compare_features_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    ftext1 = context.user_data["saved_features"][context.args[0]]
-    ftext2 = context.user_data["saved_features"][context.args[1]]
-
-    comparison_results = compare_features(ftext1, ftext2)
+    name1, name2 = context.args[0], context.args[1]
+    features1 = as_feature_set(context.user_data["saved_features"][name1])
+    features2 = as_feature_set(context.user_data["saved_features"][name2])
+
+    # exact and near-exact keys are matched locally, only the leftovers go to the model
+    with span("compare_local"):
+        lines, residue1, residue2 = compare_feature_sets(features1, features2, name1, name2)
+    comparison_results = "\n".join(lines)
+    if residue1 and residue2:
+        with span("llm_comparison"):
+            comparison_results += "\n" + await compare_features(formatted_str(residue1), formatted_str(residue2))
     text_chunks = [comparison_results[i:i + MAX_MESSAGE_LENGTH]
                    for i in range(0, len(comparison_results), MAX_MESSAGE_LENGTH)]
     for text_chunk in text_chunks:
         await update.message.reply_text(text_chunk)
 
 
-async def delete_queries(update: Update, context: ContextTypes.DEFAULT_TYPE, q_type: str) -> None:
-    chat_id = update.message.chat.id
-    messages = context.user_data.get(q_type, [])
+async def search_features(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    conditions = parse_search_query(" ".join(context.args))
+    if not conditions:
+        await update.message.reply_text("Укажите условия поиска, например: /search Грузоподъемность>=800 Клиренс>=600")
+        return
+
+    results = (await get_feature_index(context)).search(conditions)
+    if not results:
+        await update.message.reply_text("Подходящих наборов фич не найдено.")
+        return
+
+    user_id = update.effective_user.id
+    lines = [f"Найдено наборов фич: {len(results)}"]
+    for owner, name in results[:MAX_SEARCH_RESULTS]:
+        lines.append(name if owner == user_id else f"{name} (другой пользователь)")
+    await update.message.reply_text("\n".join(lines)[:MAX_MESSAGE_LENGTH])
 
-    for message_id in messages:
+
+async def compare_matrix_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    saved_features = context.user_data.get("saved_features", {})
+    names = [name for name in context.args if name in saved_features]
+    if len(names) < 2:
+        await update.message.reply_text("Укажите хотя бы два сохраненных набора фич: /matrix имя1 имя2 имя3")
+        return
+
+    comparison_results = "\n".join(compare_matrix([as_feature_set(saved_features[name]) for name in names], names))
+    text_chunks = [comparison_results[i:i + MAX_MESSAGE_LENGTH]
+                   for i in range(0, len(comparison_results), MAX_MESSAGE_LENGTH)]
+    for text_chunk in text_chunks:
+        await update.message.reply_text(text_chunk)
+
+
+async def delete_message_limited(bot, chat_id: int, message_id: int, semaphore: asyncio.Semaphore) -> None:
+    async with semaphore:
+        await telegram_bucket.acquire()
         try:
-            await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+            await bot.delete_message(chat_id=chat_id, message_id=message_id)
+        except RetryAfter as e:
+            telegram_bucket.pause(e.retry_after)
+            logger.warning("Error deleting message %s: %s", message_id, e)
         except Exception as e:
-            print(f"Error deleting message {message_id}: {e}")
+            logger.warning("Error deleting message %s: %s", message_id, e)
+
+
+async def delete_messages(bot, chat_id: int, message_ids: list) -> None:
+    if not message_ids:
+        return
+    for start in range(0, len(message_ids), DELETE_BATCH_SIZE):
+        batch = message_ids[start:start + DELETE_BATCH_SIZE]
+        if hasattr(bot, "delete_messages"):
+            await telegram_bucket.acquire()
+            try:
+                await bot.delete_messages(chat_id=chat_id, message_ids=batch)
+                continue
+            except RetryAfter as e:
+                telegram_bucket.pause(e.retry_after)
+            except Exception as e:
+                logger.warning("Error deleting messages in bulk: %s", e)
+        # older Bot API or a failed batch, delete one by one but concurrently
+        semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+        await asyncio.gather(*[delete_message_limited(bot, chat_id, message_id, semaphore)
+                               for message_id in batch])
 
-    context.user_data[q_type] = []
+
+async def delete_queries(update: Update, context: ContextTypes.DEFAULT_TYPE, *q_types: str) -> None:
+    chat_id = update.message.chat.id
+    message_ids = []
+    for q_type in q_types:
+        message_ids.extend(context.user_data.get(q_type, []))
+        context.user_data[q_type] = []
+    await delete_messages(context.bot, chat_id, message_ids)
 
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -319,29 +587,52 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 
 async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await delete_queries(update, context, q_type="items_queries")
+    await delete_queries(update, context, "items_queries")
     await update.message.reply_text("Редактирование отменено.")
     return ConversationHandler.END
 
 
-def main() -> None:
-    persistence = PicklePersistence(filepath=".hackatton_bot_data")
+async def post_shutdown(application: Application) -> None:
+    await llm_client.close()
+
 
-    application = (
+def register_metrics() -> None:
+    registry.register_callback("ocr_queue_depth", lambda: ocr_executor.queue_depth)
+    registry.register_callback("ocr_jobs_in_flight", lambda: ocr_executor.in_flight)
+    registry.register_callback("llm_cache_hits_total", lambda: llm_cache.hits, metric_type="counter")
+    registry.register_callback("llm_cache_misses_total", lambda: llm_cache.misses, metric_type="counter")
+    registry.register_callback("llm_retries_total", lambda: llm_client.retries, metric_type="counter")
+
+
+def build_application(persistence: SQLitePersistence, concurrent_updates=None,
+                      bot_api_url: str = None) -> Application:
+    if concurrent_updates is None:
+        # one chat's updates share its conversation state and user_data, so they run one at a time
+        concurrent_updates = PerChatUpdateProcessor()
+    builder = (
         Application.builder()
         .token(TOKEN)
         .persistence(persistence)
         .arbitrary_callback_data(True)
-        .build()
+        # handlers await OCR and the model, other updates must keep being processed meanwhile
+        .concurrent_updates(concurrent_updates)
+        .post_shutdown(post_shutdown)
     )
+    if bot_api_url is not None:
+        # a local Bot API server or a stand-in for tests
+        builder = builder.base_url(bot_api_url).base_file_url(bot_api_url.replace("/bot", "/file/bot"))
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("test", test))
     application.add_handler(CommandHandler("saved", list_of_saved_features))
     application.add_handler(CommandHandler("compare", compare_features_data))
+    application.add_handler(CommandHandler("search", search_features))
+    application.add_handler(CommandHandler("matrix", compare_matrix_data))
     application.add_handler(CommandHandler("stop", stop))
 
     application.add_handler(CallbackQueryHandler(choose_features_data, pattern=".+_features$"))
+    application.add_handler(CallbackQueryHandler(editor_page_handler, pattern=r"editor_page_\d+$"))
 
     output_conv_handler = ConversationHandler(
         entry_points=[CallbackQueryHandler(output_button_handler,
@@ -356,21 +647,37 @@ def main() -> None:
             CommandHandler("cancel", cancel),
         ],
         allow_reentry=True,
+        name="output_conversation",
+        persistent=True,
     )
     editor_conv_handler = ConversationHandler(
         entry_points=[CallbackQueryHandler(items_button_handler,
-                                           pattern="(edit_item|delete_item)$")],
+                                           pattern=r"(edit_item|delete_item)_\d+_\d+$")],
         states={"AWAITING_FEATURE_EDIT": [MessageHandler(filters.TEXT and ~filters.COMMAND, handle_feature_edit)]},
         fallbacks=[CommandHandler("stop", stop), CommandHandler("cancel", cancel)],
         allow_reentry=True,
+        name="editor_conversation",
+        persistent=True,
     )
 
     application.add_handler(output_conv_handler)
     application.add_handler(editor_conv_handler)
 
     application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
+    return application
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+def main() -> None:
+    register_metrics()
+    start_metrics_server()
+    application = build_application(SQLitePersistence())
+
+    try:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        ocr_executor.shutdown()
+        document_cache.close()
+        llm_cache.close()
 
 
 if __name__ == "__main__":
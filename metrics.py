@@ -0,0 +1,173 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+DURATION_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+logger = logging.getLogger("metrics")
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ""
+    escaped = ",".join('{}="{}"'.format(name, value.replace("\\", "\\\\").replace('"', '\\"'))
+                       for name, value in labels)
+    return "{" + escaped + "}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._callbacks = {}
+        self._histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def register_callback(self, name: str, callback, metric_type: str = "gauge", **labels) -> None:
+        # the value is read at scrape time, e.g. a queue depth
+        with self._lock:
+            self._callbacks[(name, _label_key(labels))] = (callback, metric_type)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(DURATION_BUCKETS), 0.0, 0]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self) -> str:
+        lines = []
+        typed = set()
+
+        def type_line(name: str, metric_type: str) -> None:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            callbacks = sorted(self._callbacks.items(), key=lambda item: item[0])
+            histograms = sorted((key, ([*buckets], total, count))
+                                for key, (buckets, total, count) in self._histograms.items())
+
+        for (name, labels), value in counters:
+            type_line(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            type_line(name, "gauge")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), (callback, metric_type) in callbacks:
+            try:
+                value = callback()
+            except Exception as e:
+                logger.warning("metric callback %s failed: %s", name, e)
+                continue
+            type_line(name, metric_type)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), (buckets, total, count) in histograms:
+            type_line(name, "histogram")
+            for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', str(bound)),))} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+_worker_spans = None  # set while a job runs in a pool worker, see call_with_spans
+
+
+def log_event(event: str, **fields) -> None:
+    logger.info(json.dumps({"event": event, **fields}, ensure_ascii=False, default=str))
+
+
+@contextmanager
+def span(stage: str, **labels):
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        if _worker_spans is not None:
+            _worker_spans.append((stage, status, duration))
+        else:
+            registry.observe("stage_duration_seconds", duration, stage=stage, status=status)
+        log_event("span", stage=stage, status=status, duration=round(duration, 4), **labels)
+
+
+def call_with_spans(func, *args):
+    # runs in a process pool worker, whose registry is never scraped: the spans of the job
+    # are returned with its result and observed in the parent by observe_spans
+    global _worker_spans
+    _worker_spans = []
+    try:
+        return func(*args), _worker_spans
+    finally:
+        _worker_spans = None
+
+
+def observe_spans(spans: list) -> None:
+    for stage, status, duration in spans:
+        registry.observe("stage_duration_seconds", duration, stage=stage, status=status)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    pass
+
+
+if __name__ == "__main__":
+    main()
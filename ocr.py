@@ -1,33 +1,183 @@
 import PyPDF2
 import ocrmypdf
 import os
+import shutil
+import tempfile
+from io import BytesIO
 
+import config
+from metrics import span
 
-def extract_text_from_pdf(pdf_file: str) -> str:
-    with open(pdf_file, "rb") as f:
-        reader = PyPDF2.PdfReader(f)
-        num_pages = len(reader.pages)
-        text = ""
-        for page_num in range(num_pages):
-            page = reader.pages[page_num]
-            text += page.extract_text()
-    return text
-
-
-def extract_text(f_name: str) -> str:
-    dir_m = os.getcwd()
-    input_path = os.path.join(dir_m, "input-pdfs", f_name)
-    temp_path = os.path.join(dir_m, "temp", f_name)
-
-    text = extract_text_from_pdf(input_path)
-    if text == '':
-        ocrmypdf.ocr(input_path, temp_path, language='rus')
-    else:
-        ocrmypdf.ocr(input_path, temp_path, language='rus', force_ocr=True)
-    extracted_text = extract_text_from_pdf(temp_path)
-    os.remove(temp_path)
-    # os.remove(input_path)
-    return extracted_text
+
+PAGE_SEPARATOR = "\n\f"
+OCR_PAGES_PER_JOB = 4
+
+MIN_PAGE_TEXT_LENGTH = 40
+MAX_GARBAGE_RATIO = 0.05
+MIN_CYRILLIC_RATIO = 0.3
+TEXT_PUNCTUATION = set(".,:;!?-–—()[]{}<>/\\|\"'«»%№°±×*+=_#&@~^`$€₽")
+
+LAYOUT_LINE_TOLERANCE = 0.5  # in font sizes, fragments closer than this vertically share a line
+LAYOUT_COLUMN_GAP = 2.0  # in font sizes, a wider horizontal gap separates table cells
+LAYOUT_PARAGRAPH_GAP = 2.0  # in font sizes, a wider vertical gap is kept as an empty line
+LAYOUT_CHAR_WIDTH = 0.55  # average glyph width in font sizes, positions give only the start of a fragment
+LAYOUT_MIN_COVERAGE = 0.9  # share of the plain text the layout text must keep to be used
+
+# OCR_MODE 'sidecar' reads tesseract's own text, 'pdf' renders an output PDF and reads its text layer back
+OCR_MODE = getattr(config, "OCR_MODE", "sidecar")
+OCR_LANGUAGE = getattr(config, "OCR_LANGUAGE", "rus")
+OCR_JOBS = getattr(config, "OCR_JOBS", 1)  # per page range, the ranges themselves already run in parallel
+OCR_OVERSAMPLE_DPI = getattr(config, "OCR_OVERSAMPLE_DPI", 0)  # 0 keeps the resolution of the scan
+OCR_PAGESEGMODE = getattr(config, "OCR_PAGESEGMODE", None)  # tesseract --psm, None is its automatic layout
+SIDECAR_PAGE_BREAK = "\f"
+
+# e.g. "/dev/shm" to keep OCR intermediate files off the disk, only where tmpfs has room for them
+# (docker gives /dev/shm 64 MB); None is the system temp directory
+OCR_TEMP_ROOT = getattr(config, "OCR_TEMP_ROOT", None)
+
+
+def open_pdf(source) -> PyPDF2.PdfReader:
+    # source is either a path or the bytes of the document
+    if isinstance(source, (bytes, bytearray)):
+        return PyPDF2.PdfReader(BytesIO(source))
+    return PyPDF2.PdfReader(source)
+
+
+def extract_page_text(page) -> str:
+    # plain extract_text puts every table cell on its own line, the fragment positions
+    # let the rows be put back together with a tab between the cells
+    fragments = []
+
+    def visitor(text, cm, tm, font_dict, font_size):
+        if not text.strip():
+            return
+        x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+        y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+        size = abs(font_size * (tm[3] or 1) * (cm[3] or 1)) or 1.0
+        for line_no, part in enumerate(text.split("\n")):
+            if part.strip():
+                fragments.append((y - line_no * size, x, size, part))
+
+    plain = page.extract_text(visitor_text=visitor) or ""
+    if not fragments:
+        return plain
+
+    lines = []
+    for y, x, size, part in sorted(fragments, key=lambda fragment: (-fragment[0], fragment[1])):
+        if lines and abs(lines[-1][0] - y) <= LAYOUT_LINE_TOLERANCE * size:
+            lines[-1][1].append((x, size, part))
+        else:
+            lines.append((y, [(x, size, part)]))
+
+    rows = []
+    previous_y = None
+    for y, cells in lines:
+        if previous_y is not None and previous_y - y > LAYOUT_PARAGRAPH_GAP * cells[0][1]:
+            rows.append("")
+        previous_y = y
+        row = ""
+        end = None
+        for x, size, part in sorted(cells):
+            if end is not None:
+                row += "\t" if x - end > LAYOUT_COLUMN_GAP * size else " "
+            row += part.strip()
+            end = x + len(part.strip()) * size * LAYOUT_CHAR_WIDTH
+        rows.append(row)
+    layout = "\n".join(rows)
+
+    if len("".join(layout.split())) < LAYOUT_MIN_COVERAGE * len("".join(plain.split())):
+        return plain
+    return layout
+
+
+def extract_pages_from_pdf(pdf_file) -> list:
+    return [extract_page_text(page) for page in open_pdf(pdf_file).pages]
+
+
+def extract_text_from_pdf(pdf_file) -> str:
+    return PAGE_SEPARATOR.join(extract_pages_from_pdf(pdf_file))
+
+
+def is_usable_text_layer(text: str) -> bool:
+    chars = "".join(text.split())
+    if len(chars) < MIN_PAGE_TEXT_LENGTH:
+        return False
+
+    garbage = sum(1 for ch in chars if not ch.isalnum() and ch not in TEXT_PUNCTUATION)
+    if garbage / len(chars) > MAX_GARBAGE_RATIO:
+        return False
+
+    letters = [ch.lower() for ch in chars if ch.isalpha()]
+    if not letters:
+        return False
+    cyrillic = sum(1 for ch in letters if "а" <= ch <= "я" or ch == "ё")
+    return cyrillic / len(letters) >= MIN_CYRILLIC_RATIO
+
+
+def read_text_layer(source) -> tuple:
+    with span("text_layer"):
+        pages = extract_pages_from_pdf(source)
+    bad_pages = [page_no for page_no, text in enumerate(pages, start=1) if not is_usable_text_layer(text)]
+    return pages, bad_pages
+
+
+def split_page_ranges(page_numbers: list, pages_per_job: int = OCR_PAGES_PER_JOB) -> list:
+    page_numbers = sorted(page_numbers)
+    return [page_numbers[i:i + pages_per_job] for i in range(0, len(page_numbers), pages_per_job)]
+
+
+def run_ocrmypdf(input_path: str, output_path: str, **options) -> None:
+    ocrmypdf.ocr(input_path, output_path, language=OCR_LANGUAGE, force_ocr=True, jobs=OCR_JOBS,
+                 oversample=OCR_OVERSAMPLE_DPI or None, tesseract_pagesegmode=OCR_PAGESEGMODE,
+                 progress_bar=False, **options)
+
+
+def ocr_to_sidecar(input_path: str, job_dir: str) -> list:
+    # only the text is requested: no output PDF, no PDF/A conversion, no optimization, no re-reading
+    sidecar_path = os.path.join(job_dir, "ocr.txt")
+    run_ocrmypdf(input_path, os.devnull, output_type="none", optimize=0, sidecar=sidecar_path)
+    with open(sidecar_path, encoding="utf-8") as sidecar:
+        return [page.strip("\n") for page in sidecar.read().split(SIDECAR_PAGE_BREAK)]
+
+
+def ocr_to_pdf(input_path: str, job_dir: str) -> list:
+    output_path = os.path.join(job_dir, "ocr.pdf")
+    run_ocrmypdf(input_path, output_path)
+    return extract_pages_from_pdf(output_path)
+
+
+def ocr_pages(source, page_numbers: list, temp_dir: str = None, mode: str = None) -> list:
+    # every job stages its files in its own directory, so equal file names never collide
+    job_dir = tempfile.mkdtemp(prefix="ocr_", dir=temp_dir or OCR_TEMP_ROOT)
+    try:
+        subset_path = os.path.join(job_dir, "subset.pdf")
+
+        writer = PyPDF2.PdfWriter()
+        reader = open_pdf(source)
+        for page_no in page_numbers:
+            writer.add_page(reader.pages[page_no - 1])
+        with open(subset_path, "wb") as subset_file:
+            writer.write(subset_file)
+
+        # the ranges run in parallel, each with OCR_JOBS tesseract processes
+        mode = mode or OCR_MODE
+        with span("tesseract", pages=len(page_numbers), mode=mode):
+            if mode == "pdf":
+                texts = ocr_to_pdf(subset_path, job_dir)
+            else:
+                texts = ocr_to_sidecar(subset_path, job_dir)
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+    return list(zip(page_numbers, texts))
+
+
+def extract_text(source, temp_dir: str = None) -> str:
+    # keep the text layer of good pages, OCR only the pages without one
+    pages, bad_pages = read_text_layer(source)
+    if bad_pages:
+        for page_no, text in ocr_pages(source, bad_pages, temp_dir):
+            pages[page_no - 1] = text
+    return PAGE_SEPARATOR.join(pages)
 
 
 def main() -> None:
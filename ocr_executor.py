@@ -0,0 +1,172 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import call_with_spans, observe_spans, registry, span
+from ocr import PAGE_SEPARATOR, ocr_pages, read_text_layer, split_page_ranges
+
+
+OCR_MAX_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+OCR_MAX_IN_FLIGHT = OCR_MAX_WORKERS * 2
+OCR_JOB_TIMEOUT = 600  # seconds
+
+
+class OcrTimeoutError(Exception):
+    pass
+
+
+class OcrExecutor:
+    def __init__(self, max_workers: int = OCR_MAX_WORKERS, max_in_flight: int = OCR_MAX_IN_FLIGHT,
+                 timeout: float = OCR_JOB_TIMEOUT) -> None:
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self._pool = None
+        self._semaphore = None
+        self._waiting = 0
+        self._running = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+
+    @property
+    def in_flight(self) -> int:
+        return self._running
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    def _recycle_pool(self, pool: ProcessPoolExecutor) -> None:
+        # a single worker of ProcessPoolExecutor cannot be stopped, so the pool of a timed out job is
+        # replaced and its processes are killed; jobs that ran next to it are resubmitted by run
+        if self._pool is pool:
+            self._pool = None
+        processes = list((pool._processes or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+        registry.inc("ocr_pool_recycled_total")
+
+    async def _finish_abandoned(self, pool: ProcessPoolExecutor, future: asyncio.Future, deadline: float) -> None:
+        # the caller of a started job was cancelled, but its worker process is busy until the job ends;
+        # past the job timeout, or when cancelled again while waiting, the pool is recycled instead
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=max(0.0, deadline - time.monotonic()))
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self._recycle_pool(pool)
+            # fails with BrokenProcessPool once the process is killed, nobody is left to await it
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        except Exception:
+            pass
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # created lazily so that it is bound to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphore
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        semaphore = self._get_semaphore()
+
+        self._waiting += 1
+        queued_at = time.perf_counter()
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        registry.observe("ocr_queue_wait_seconds", time.perf_counter() - queued_at)
+
+        self._running += 1
+        try:
+            with span(f"ocr_job_{func.__name__}"):
+                for attempt in range(2):
+                    pool = self._get_pool()
+                    job = pool.submit(call_with_spans, func, *args)
+                    future = asyncio.wrap_future(job, loop=loop)
+                    deadline = time.monotonic() + self.timeout
+                    try:
+                        # shielded, so the job can still be awaited after the timeout
+                        result, spans = await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+                    except asyncio.TimeoutError:
+                        self._recycle_pool(pool)
+                        # the slot is given back only once the worker process is gone
+                        await asyncio.gather(future, return_exceptions=True)
+                        raise OcrTimeoutError(f"OCR job did not finish in {self.timeout} seconds")
+                    except asyncio.CancelledError:
+                        # a job still waiting for a worker is dropped, a running one keeps the slot
+                        if not job.cancel():
+                            await self._finish_abandoned(pool, future, deadline)
+                        raise
+                    except BrokenProcessPool:
+                        # killed along with a timed out job, or a worker crashed
+                        if attempt:
+                            raise
+                        if self._pool is pool:
+                            self._recycle_pool(pool)
+                    else:
+                        # timed in the worker process, observed here where /metrics is served
+                        observe_spans(spans)
+                        return result
+        finally:
+            self._running -= 1
+            semaphore.release()
+
+    async def iter_pages(self, source, temp_dir: str = None):
+        # source is a path or the bytes of the PDF
+        # yields (page_no, text) in page order as soon as every earlier page is ready
+        pages, bad_pages = await self.run(read_text_layer, source)
+        bad = set(bad_pages)
+        ready = {page_no: text for page_no, text in enumerate(pages, start=1) if page_no not in bad}
+        jobs = [asyncio.ensure_future(self.run(ocr_pages, source, page_range, temp_dir))
+                for page_range in split_page_ranges(bad_pages)]
+
+        next_page = 1
+        try:
+            while next_page in ready:
+                yield next_page, ready.pop(next_page)
+                next_page += 1
+            for job in asyncio.as_completed(jobs):
+                for page_no, text in await job:
+                    ready[page_no] = text
+                while next_page in ready:
+                    yield next_page, ready.pop(next_page)
+                    next_page += 1
+        finally:
+            for job in jobs:
+                job.cancel()
+
+    async def extract_pages(self, source, temp_dir: str = None) -> list:
+        return [text async for _, text in self.iter_pages(source, temp_dir)]
+
+    async def extract_text(self, source, temp_dir: str = None) -> str:
+        return PAGE_SEPARATOR.join(await self.extract_pages(source, temp_dir))
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+        }
+
+    def shutdown(self, wait: bool = False) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+
+ocr_executor = OcrExecutor()
+
+
+def main() -> None:
+    pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,83 +1,296 @@
-from openai import OpenAI
+import asyncio
+import json
+import re
 
-from data_converter import text_to_dict, formatted_str, parse_text_to_find_dict
+from data_converter import (
+    FeatureSet,
+    StreamingFeatureParser,
+    apply_patch,
+    merge_feature_dicts,
+    parse_patch,
+    parse_text_to_find_dict,
+    stem_word,
+    text_to_dict,
+)
+from llm_cache import llm_cache, make_key
+from llm_client import LLMClient
+from metrics import log_event, registry, span
+from preprocessing import PAGE_BREAK, PREPROCESS_TOKEN_BUDGET, PagePreprocessor, clean_line
+from rule_extractor import extract_rule_based
+from tokenizer import count_tokens, split_text, truncate_tokens
 from config import API_KEY
 
 
-client = OpenAI(api_key=API_KEY)
+llm_client = LLMClient(api_key=API_KEY)
 model = "gpt-3.5-turbo"
+CHUNK_TOKEN_BUDGET = 3000  # larger documents are extracted chunk by chunk
+MIN_LLM_TOKENS = 40  # a smaller residue is headings and stray words, not worth a request
+PROMPT_VERSION = "1"  # bump when the prompts below change to invalidate cached answers
+HISTORY_TOKEN_BUDGET = 800  # refinement turns kept for context, the feature set carries the rest
+EXCERPT_TOKEN_BUDGET = 1500  # document lines sent along with a refinement request
 
+EXTRACTION_PROMPT = ("Попробуй извлечь фичи товара из этого текста, текст был распознан "
+                     "OCR, некоторые символы могли быть повреждены или пропущены, попробуй "
+                     "их восстановить. "
+                     "Представь ответ ввиде dict python {'фича': 'значение'}. "
+                     "Не должно быть вложенных словарей и списков. "
+                     "Избегай юридической информации, оставь только технические "
+                     "характеристики, а также пропускай данные в которых не уверен. ")
+REFINEMENT_PROMPT = ("Ниже текущий набор фич товара в виде dict python. Пользователь попросит его изменить. "
+                     "Ответь только списком изменений, по одному на строку, без пояснений:\n"
+                     "ADD ключ: значение - добавить фичу\n"
+                     "CHANGE ключ: значение - изменить значение фичи\n"
+                     "DELETE ключ - удалить фичу\n"
+                     "Используй ключи в точности так, как они записаны в наборе. Значения бери из "
+                     "фрагментов документа, если они приведены. ")
+COMPARISON_PROMPT = ("У меня есть набор фичей, полученный из технических паспортов двух товаров. "
+                     "Нужно найти общие характеристики среди их свойств и вывести в формате:\n"
+                     "Свойство | Характеристика первого товара | Характеристика второго товара\n"
+                     "Если ты видишь, что ключи немного отличаются, но смысл характеристик "
+                     "одинаковый, старайся включать их в ответ. Ты можешь также немного "
+                     "преобразовать как ключи, так и значения фичей, чтобы привести их к одному, "
+                     "удобно сравнимому виду. Приведи в ответе только те фичи, которые есть у "
+                     "обоих товаров. Если характеристика есть только у одного, то пропускай ее. ")
 
-def generate_response(text: str) -> str:
-    cleaned_text = clean_text(text)
-    completion = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {
-                "role": "user", "content": "Попробуй извлечь фичи товара из этого текста, текст был распознан "
-                                           "OCR, некоторые символы могли быть повреждены или пропущены, попробуй "
-                                           "их восстановить. "
-                                           "Представь ответ ввиде dict python {'фича': 'значение'}. "
-                                           "Не должно быть вложенных словарей и списков. "
-                                           "Избегай юридической информации, оставь только технические "
-                                           "характеристики, а также пропускай данные в которых не уверен. "
-                                           f"{cleaned_text}"
-            },
-        ]
-    )
-    parsed_text = parse_text_to_find_dict(completion.choices[0].message.content)
-    feature_text = formatted_str(text_to_dict(parsed_text))
-    return feature_text
-
-
-def make_direct_prompt(text: str, cleaned_text: str, messages_history: list) -> str:
-    completion = client.chat.completions.create(
-        model=model,
-        messages=[
+
+async def complete(messages: list, on_progress=None) -> str:
+    if on_progress is None:
+        return await llm_client.chat(model, messages)
+
+    # stream the answer and report every newly completed 'key': 'value' pair
+    parser = StreamingFeatureParser()
+    parts = []
+    async for delta in llm_client.stream_chat(model, messages):
+        parts.append(delta)
+        if parser.feed(delta):
+            await on_progress(FeatureSet(parser.features))
+    return "".join(parts)
+
+
+def parse_features(content: str) -> dict:
+    # every way an answer can be unusable ends up as ValueError, those are retried
+    try:
+        feature_dict = text_to_dict(parse_text_to_find_dict(content))
+    except (SyntaxError, TypeError, ValueError, MemoryError, RecursionError) as e:
+        raise ValueError(f"the answer is not a python dict: {e}") from e
+    if not isinstance(feature_dict, dict):
+        raise ValueError(f"the answer is a {type(feature_dict).__name__}, not a dict")
+    return feature_dict
+
+
+async def extract_features(cleaned_text: str, on_progress=None) -> dict:
+    key = make_key(model, PROMPT_VERSION, "generate_response", cleaned_text)
+    content = llm_cache.get(key)
+    cached = content is not None
+    if not cached:
+        content = await complete([
             {"role": "system", "content": "You are a helpful assistant."},
-            {
-                "role": "user", "content": "Попробуй извлечь фичи товара из этого текста, текст был распознан "
-                                           "OCR, некоторые символы могли быть повреждены или пропущены, попробуй "
-                                           "их восстановить. "
-                                           "Представь ответ ввиде dict python {'фича': 'значение'}. "
-                                           "Не должно быть вложенных словарей и списков. "
-                                           "Избегай юридической информации, оставь только технические "
-                                           "характеристики, а также пропускай данные в которых не уверен. "
-                                           f"{cleaned_text}"
-            },
-        ] + messages_history
-    )
-    print(completion.choices[0].message.content)
-    parsed_text = parse_text_to_find_dict(completion.choices[0].message.content)
-    feature_text = formatted_str(text_to_dict(parsed_text))
-    return feature_text, completion.choices[0].message.content
-
-
-def compare_features(ftext_1: str, ftext_2: str) -> str:
-    completion = client.chat.completions.create(
-        model=model,
-        messages=[
+            {"role": "user", "content": EXTRACTION_PROMPT + cleaned_text},
+        ], on_progress)
+    with span("parse"):
+        try:
+            feature_dict = parse_features(content)
+        except ValueError:
+            if cached:
+                # cached before answers were checked, it would fail every later upload
+                llm_cache.delete(key)
+            raise
+    # only answers that parse into a dict are cached, so retries still reach the model
+    if not cached:
+        llm_cache.put(key, content)
+    return feature_dict
+
+
+class DocumentExtraction:
+    # pages are added as OCR finishes them, every full chunk goes to the model right away,
+    # so the extraction of the first chunks overlaps the recognition of the later pages
+
+    def __init__(self, pages=()) -> None:
+        self.pages = 0
+        self.preprocessor = PagePreprocessor()
+        self.local_dicts = []
+        self.rule_stats = {"features": 0, "lines": 0, "explained": 0.0}
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.truncated = False
+        self.pending = []  # cleaned pages of the chunk being filled
+        self.pending_tokens = 0
+        self.jobs = []
+        for page in pages:
+            self.add_page(page)
+
+    def add_page(self, page: str) -> None:
+        # tables and 'key: value' lines are read locally, only the rest of the page reaches the model
+        self.pages += 1
+        with span("rule_extraction"):
+            local_features, residue, stats = extract_rule_based(page)
+        self.local_dicts.append(local_features)
+        self.rule_stats["features"] += stats["features"]
+        self.rule_stats["lines"] += stats["lines"]
+        self.rule_stats["explained"] += stats["coverage"] * stats["lines"]
+
+        # repeated headers, contacts and OCR noise are dropped before they are paid for
+        with span("preprocessing"):
+            self.tokens_before += count_tokens(residue)
+            cleaned = self.preprocessor.clean_page(residue).replace("'", '"')
+        if not cleaned or self.truncated:
+            return
+        tokens = count_tokens(cleaned)
+        if self.tokens_after + tokens > PREPROCESS_TOKEN_BUDGET:
+            # spec sheets put the main characteristics first, so the tail is what gets cut
+            cleaned = truncate_tokens(cleaned, PREPROCESS_TOKEN_BUDGET - self.tokens_after)
+            tokens = count_tokens(cleaned)
+            self.truncated = True
+        self.tokens_after += tokens
+        self.pending.append(cleaned)
+        self.pending_tokens += tokens
+        if self.pending_tokens > CHUNK_TOKEN_BUDGET:
+            # the last chunk may still grow with the next pages, the full ones are sent now
+            chunks = split_text(("\n" + PAGE_BREAK).join(self.pending), CHUNK_TOKEN_BUDGET)
+            self.jobs += [asyncio.ensure_future(extract_features(chunk)) for chunk in chunks[:-1]]
+            self.pending = chunks[-1:]
+            self.pending_tokens = sum(map(count_tokens, self.pending))
+
+    def cancel(self) -> None:
+        for job in self.jobs:
+            if job.done():
+                # retrieved so that a failed chunk of an abandoned document is not reported as unhandled
+                job.cancelled() or job.exception()
+            else:
+                job.cancel()
+
+    async def finish(self, on_progress=None) -> FeatureSet:
+        local_features = merge_feature_dicts(self.local_dicts)
+        lines = self.rule_stats["lines"]
+        registry.inc("rule_extracted_features_total", self.rule_stats["features"])
+        log_event("rule_extraction", features=self.rule_stats["features"], lines=lines,
+                  coverage=round(self.rule_stats["explained"] / lines, 3) if lines else 0.0)
+        registry.inc("preprocessing_tokens_saved_total", self.tokens_before - self.tokens_after)
+        log_event("preprocessing", tokens_before=self.tokens_before, tokens_after=self.tokens_after,
+                  tokens_saved=self.tokens_before - self.tokens_after,
+                  removed_lines=self.preprocessor.removed_lines, truncated=self.truncated)
+
+        chunks = split_text(("\n" + PAGE_BREAK).join(self.pending), CHUNK_TOKEN_BUDGET)
+        if not self.jobs and (not chunks or count_tokens(chunks[0]) < MIN_LLM_TOKENS):
+            # a smaller residue is headings and stray words
+            registry.inc("llm_skipped_documents_total")
+            return FeatureSet(local_features)
+
+        progress = on_progress
+        if on_progress is not None and local_features:
+            async def progress(features: FeatureSet) -> None:
+                await on_progress(FeatureSet(merge_feature_dicts([local_features, features.to_dict()])))
+
+        if not self.jobs and len(chunks) == 1:
+            return FeatureSet(merge_feature_dicts([local_features, await extract_features(chunks[0], progress)]))
+
+        self.jobs += [asyncio.ensure_future(extract_features(chunk)) for chunk in chunks]
+        try:
+            if on_progress is None:
+                await asyncio.wait(self.jobs)
+            else:
+                # chunks are not streamed individually, progress is reported as each chunk is merged in
+                feature_dicts = []
+                for job in asyncio.as_completed(self.jobs):
+                    try:
+                        feature_dicts.append(await job)
+                    except Exception:
+                        continue
+                    await on_progress(FeatureSet(merge_feature_dicts([local_features] + feature_dicts)))
+        finally:
+            # chunks that did parse are cached by now, a retry only asks the model for the failed ones
+            self.cancel()
+        return FeatureSet(merge_feature_dicts([local_features] + [job.result() for job in self.jobs]))
+
+
+async def generate_response(text: str, on_progress=None) -> FeatureSet:
+    return await DocumentExtraction(text.split(PAGE_BREAK)).finish(on_progress)
+
+
+def compact_history(history: list, token_budget: int = HISTORY_TOKEN_BUDGET) -> list:
+    # the oldest turns are dropped first, their result is already in the feature set
+    tokens = [count_tokens(message["content"]) for message in history]
+    total = sum(tokens)
+    start = 0
+    while start < len(history) and total > token_budget:
+        total -= tokens[start]
+        start += 1
+    return history[start:]
+
+
+def document_excerpt(text: str, request: str, token_budget: int = EXCERPT_TOKEN_BUDGET) -> str:
+    # the lines sharing word stems with the request, in document order, instead of the whole document
+    request_stems = {stem_word(word) for word in re.findall(r"\w{3,}", request.lower())}
+    scored = []
+    for position, line in enumerate(text.splitlines()):
+        line = clean_line(line)
+        score = len(request_stems & {stem_word(word) for word in re.findall(r"\w{3,}", line.lower())})
+        if score:
+            scored.append((score, position, line))
+
+    selected = []
+    total = 0
+    for score, position, line in sorted(scored, key=lambda item: (-item[0], item[1])):
+        tokens = count_tokens(line)
+        if total + tokens > token_budget:
+            continue
+        selected.append((position, line))
+        total += tokens
+    return "\n".join(line for _, line in sorted(selected))
+
+
+async def complete_patch(messages: list, features: FeatureSet, on_progress=None) -> str:
+    if on_progress is None:
+        return await llm_client.chat(model, messages)
+
+    # every completed patch line is applied to a preview of the feature set
+    parts = []
+    applied = 0
+    async for delta in llm_client.stream_chat(model, messages):
+        parts.append(delta)
+        if "\n" in delta:
+            operations = parse_patch("".join(parts).rsplit("\n", 1)[0])
+            if len(operations) > applied:
+                applied = len(operations)
+                await on_progress(apply_patch(features, operations))
+    return "".join(parts)
+
+
+async def refine_features(request: str, features: FeatureSet, document_text: str, history: list,
+                          on_progress=None) -> tuple:
+    # the prompt holds the current features, a bounded excerpt and a compacted history,
+    # so its size does not grow with the length of the conversation
+    context = REFINEMENT_PROMPT + "\n" + features.text
+    excerpt = document_excerpt(document_text or "", request)
+    if excerpt:
+        context += "\nФрагменты документа:\n" + excerpt.replace("'", '"')
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": context},
+    ] + compact_history(history) + [{"role": "user", "content": request}]
+
+    key = make_key(model, PROMPT_VERSION, "refine_features", json.dumps(messages, ensure_ascii=False))
+    content = llm_cache.get(key)
+    cached = content is not None
+    if not cached:
+        content = await complete_patch(messages, features, on_progress)
+    with span("parse"):
+        operations = parse_patch(content)
+    if not cached and operations:
+        llm_cache.put(key, content)
+    return apply_patch(features, operations), operations
+
+
+async def compare_features(ftext_1: str, ftext_2: str) -> str:
+    key = make_key(model, PROMPT_VERSION, "compare_features", ftext_1, ftext_2)
+    content = llm_cache.get(key)
+    if content is None:
+        content = await llm_client.chat(model, [
             {"role": "system", "content": "You are a helpful assistant."},
-            {
-                "role": "user", "content": "У меня есть набор фичей, полученный из технических паспортов двух товаров. "
-                                           "Нужно найти общие характеристики среди их свойств и вывести в формате:\n"
-                                           "Свойство | Характеристика первого товара | Характеристика второго товара\n"
-                                           "Если ты видишь, что ключи немного отличаются, но смысл характеристик "
-                                           "одинаковый, старайся включать их в ответ. Ты можешь также немного "
-                                           "преобразовать как ключи, так и значения фичей, чтобы привести их к одному, "
-                                           "удобно сравнимому виду. Приведи в ответе только те фичи, которые есть у "
-                                           "обоих товаров. Если характеристика есть только у одного, то пропускай ее. "
-                                           f"{ftext_1}\n{ftext_2}."
-            },
-        ]
-    )
-    return completion.choices[0].message.content
-
-
-def clean_text(text:str) -> str:
-    cleaned_text = text.replace("'", '"')
-    return cleaned_text
+            {"role": "user", "content": COMPARISON_PROMPT + f"{ftext_1}\n{ftext_2}."},
+        ])
+        llm_cache.put(key, content)
+    return content
 
 
 def main() -> None:
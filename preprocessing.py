@@ -0,0 +1,87 @@
+import re
+
+
+PAGE_BREAK = "\f"
+PREPROCESS_TOKEN_BUDGET = 24000  # hard cap per document, about eight extraction chunks
+MIN_REPEATED_LINE_LENGTH = 15  # shorter lines like 'Да' or '-' are legitimate table values on every page
+MIN_MEANINGFUL_SHARE = 0.5
+PAGE_EDGE_LINES = 2  # page numbers are only looked for in the first and last lines of a page
+KEEP_SYMBOLS = set("-–—±×%°№/:=<>≤≥~")
+
+PAGE_NUMBER_PATTERN = re.compile(r"^\W*(стр\.?|страница|лист|page)?\s*\d{1,4}(\s*(из|/|of)\s*\d{1,4})?\W*$",
+                                 re.IGNORECASE)
+CONTACT_PATTERN = re.compile(
+    r"(\b(инн|огрн|огрнип|кпп|бик|окпо|оквэд|р/с|к/с|тел|телефон|факс|e-?mail)\b"
+    r"|[\w.+-]+@[\w-]+\.[\w.]+"
+    r"|https?://|www\."
+    r"|\+7[\s(-]*\d{3})",
+    re.IGNORECASE,
+)
+LEGAL_PATTERN = re.compile(
+    r"(гарантийн\w* (обязательств|срок|талон)|все права защищены|©|правообладател|конфиденциальн"
+    r"|юридическ\w* адрес|почтов\w* адрес)",
+    re.IGNORECASE,
+)
+
+
+def normalize_line(line: str) -> str:
+    return " ".join(line.lower().split())
+
+
+def is_garbage_token(token: str) -> bool:
+    # OCR turns stains, table borders and dot leaders into runs of symbols
+    if all(ch in KEEP_SYMBOLS for ch in token):
+        return False
+    return sum(ch.isalnum() or ch in KEEP_SYMBOLS for ch in token) < MIN_MEANINGFUL_SHARE * len(token)
+
+
+def clean_line(line: str) -> str:
+    return " ".join(token for token in line.split() if not is_garbage_token(token))
+
+
+def is_page_number(line: str) -> bool:
+    return PAGE_NUMBER_PATTERN.match(line) is not None
+
+
+def is_noise_line(line: str) -> bool:
+    # a bare number inside a page is a table value when OCR puts every cell on its own line
+    return (not any(ch.isalnum() for ch in line)
+            or CONTACT_PATTERN.search(line) is not None
+            or LEGAL_PATTERN.search(line) is not None)
+
+
+class PagePreprocessor:
+    # pages are cleaned one at a time as they arrive, long lines seen on earlier pages are dropped
+    def __init__(self) -> None:
+        self.seen = set()  # repeated headers and footers are kept once
+        self.removed_lines = 0
+
+    def clean_page(self, page: str) -> str:
+        lines = []
+        page_seen = set()
+        page_lines = [clean_line(line) for line in page.splitlines()]
+        filled = [i for i, line in enumerate(page_lines) if line]
+        edges = set(filled[:PAGE_EDGE_LINES] + filled[-PAGE_EDGE_LINES:])
+        for i, line in enumerate(page_lines):
+            if not line:
+                # one blank line keeps the paragraph boundary for split_text
+                if lines and lines[-1]:
+                    lines.append("")
+                continue
+            key = normalize_line(line)
+            if (is_noise_line(line) or (i in edges and is_page_number(line))
+                    or (len(key) >= MIN_REPEATED_LINE_LENGTH and key in self.seen)):
+                self.removed_lines += 1
+                continue
+            page_seen.add(key)
+            lines.append(line)
+        self.seen.update(page_seen)
+        return "\n".join(lines).strip("\n")
+
+
+def main() -> None:
+    pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import re
+
+from data_converter import UNITS, merge_feature_dicts, normalize_key
+from preprocessing import PAGE_BREAK, is_noise_line
+
+
+MIN_SECTION_PAIRS = 2
+MIN_SECTION_COVERAGE = 0.6  # share of a section's lines that must be explained for it to skip the model
+MAX_KEY_LENGTH = 60
+MAX_KEY_WORDS = 7
+MAX_VALUE_LENGTH = 80
+MAX_VALUE_WORDS = 10
+MAX_PLAIN_VALUE_WORDS = 4  # values without digits are longer only in prose
+
+HEADER_WORDS = {"параметр", "параметры", "наименование", "наименование параметра", "характеристика",
+                "характеристики", "показатель", "значение", "величина", "ед изм", "единица измерения", "п п"}
+UNIT_HEADER_WORDS = {"ед изм", "единица измерения"}
+KEY_VALUE_PATTERN = re.compile(
+    r"^(?P<key>[A-Za-zА-Яа-яЁё][^:=\t]*?)\s*(?::|=|\.{3,}|\s[–—-]\s|\s{3,})\s*(?P<value>\S.*)$"
+)
+ROW_NUMBER_PATTERN = re.compile(r"^\d{1,3}(\.\d{1,3})*\.?$")
+
+
+def split_sections(page: str) -> list:
+    sections = []
+    for section in re.split(r"\n\s*\n", page):
+        lines = [line.strip() for line in section.splitlines() if line.strip()]
+        if lines:
+            sections.append(lines)
+    return sections
+
+
+def is_confident_pair(key: str, value: str) -> bool:
+    if not (2 <= len(key) <= MAX_KEY_LENGTH) or len(key.split()) > MAX_KEY_WORDS or key.endswith("."):
+        return False
+    if not (1 <= len(value) <= MAX_VALUE_LENGTH) or len(value.split()) > MAX_VALUE_WORDS:
+        return False
+    return any(ch.isdigit() for ch in value) or len(value.split()) <= MAX_PLAIN_VALUE_WORDS
+
+
+def is_header_row(cells: list) -> bool:
+    # '№' normalizes to nothing and does not decide anything
+    words = [normalize_key(cell) for cell in cells if normalize_key(cell)]
+    return len(cells) >= 2 and bool(words) and all(word in HEADER_WORDS for word in words)
+
+
+def parse_cells(cells: list, unit_column: int = None) -> [tuple, None]:
+    if ROW_NUMBER_PATTERN.match(cells[0]):
+        cells = cells[1:]
+    if len(cells) == 2:
+        return cells[0], cells[1]
+    if len(cells) != 3:
+        # several models side by side, the model sorts those out
+        return None
+    key, middle, last = cells
+    if unit_column == 1 or middle.lower() in UNITS:
+        return key, f"{last} {middle}"
+    if last.lower() in UNITS:
+        return key, f"{middle} {last}"
+    return None
+
+
+def parse_line(line: str, unit_column: int = None) -> [tuple, None]:
+    if "\t" in line:
+        return parse_cells([cell.strip() for cell in line.split("\t") if cell.strip()], unit_column)
+    match = KEY_VALUE_PATTERN.match(line)
+    if match is None:
+        return None
+    return match.group("key").strip(), match.group("value").strip()
+
+
+def extract_section(lines: list) -> tuple:
+    # returns the confident pairs and the lines nothing was extracted from
+    pairs = {}
+    leftover = []
+    unit_column = None
+    for line in lines:
+        cells = [cell.strip() for cell in line.split("\t") if cell.strip()]
+        if is_header_row(cells):
+            unit_columns = [i for i, cell in enumerate(cells) if normalize_key(cell) in UNIT_HEADER_WORDS]
+            unit_column = unit_columns[0] if unit_columns else None
+            continue
+        if is_noise_line(line):
+            continue
+        pair = parse_line(line, unit_column)
+        if pair is not None and is_confident_pair(*pair):
+            pairs[pair[0]] = pair[1]
+        else:
+            leftover.append(line)
+    return pairs, leftover
+
+
+def extract_rule_based(text: str) -> tuple:
+    # sections that are mostly 'key: value' lines or table rows are extracted locally,
+    # everything else is returned as the residue for the model
+    feature_dicts = []
+    residue_pages = []
+    extracted_lines = 0
+    total_lines = 0
+    for page in text.split(PAGE_BREAK):
+        # the residue keeps the page breaks, preprocessing and split_text rely on them
+        residue = []
+        for lines in split_sections(page):
+            pairs, leftover = extract_section(lines)
+            total_lines += len(lines)
+            explained = len(lines) - len(leftover)
+            if len(pairs) >= MIN_SECTION_PAIRS and explained >= MIN_SECTION_COVERAGE * len(lines):
+                feature_dicts.append(pairs)
+                extracted_lines += explained
+                if leftover:
+                    residue.append("\n".join(leftover))
+            else:
+                residue.append("\n".join(lines))
+        residue_pages.append("\n\n".join(residue))
+
+    stats = {
+        "features": sum(len(pairs) for pairs in feature_dicts),
+        "lines": total_lines,
+        "coverage": round(extracted_lines / total_lines, 3) if total_lines else 0.0,
+    }
+    return merge_feature_dicts(feature_dicts), ("\n" + PAGE_BREAK).join(residue_pages), stats
+
+
+def main() -> None:
+    pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+import asyncio
+import copy
+import hashlib
+import io
+import json
+import pickle
+import sqlite3
+import zlib
+
+from telegram import Bot, TelegramObject
+from telegram.ext import BasePersistence, ExtBot, PersistenceInput, PicklePersistence
+
+
+PERSISTENCE_PATH = ".hackatton_bot_data.sqlite3"
+BLOB_KEYS = ("initial_prompt_txt",)
+BLOB_MIN_SIZE = 1024  # characters, shorter values stay inline
+BUSY_TIMEOUT = 30  # seconds, several worker processes may write to the same file
+KNOWN_BOT = "bot"
+UNKNOWN_BOT = "unknown bot"
+# placeholders written by PicklePersistence, rows imported from it may still contain them
+LEGACY_BOT_IDS = {
+    "a known bot replaced by PTB's PicklePersistence": KNOWN_BOT,
+    "an unknown bot replaced by PTB's PicklePersistence": UNKNOWN_BOT,
+}
+
+
+def restore_telegram_object(cls, state: dict, bot):
+    obj = cls.__new__(cls)
+    obj.__setstate__(state)
+    if bot is not None:
+        obj.set_bot(bot)
+    return obj
+
+
+class BotPickler(pickle.Pickler):
+    # the Bot instance holds a connection pool, it is stored as a placeholder and swapped back on load
+
+    def __init__(self, bot: Bot, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._bot = bot
+
+    def persistent_id(self, obj):
+        if isinstance(obj, Bot):
+            return KNOWN_BOT if obj is self._bot else UNKNOWN_BOT
+        return None
+
+    def reducer_override(self, obj):
+        if not isinstance(obj, TelegramObject) or isinstance(obj, Bot):
+            return NotImplemented
+        try:
+            bot = obj.get_bot()
+        except RuntimeError:
+            bot = None
+        return restore_telegram_object, (type(obj), obj.__getstate__(), bot)
+
+
+class BotUnpickler(pickle.Unpickler):
+    def __init__(self, bot: Bot, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._bot = bot
+
+    def persistent_load(self, pid):
+        pid = LEGACY_BOT_IDS.get(pid, pid)
+        if pid == KNOWN_BOT:
+            return self._bot
+        if pid == UNKNOWN_BOT:
+            return None
+        raise pickle.UnpicklingError(f"unknown persistent id: {pid!r}")
+
+
+class BlobRef:
+    __slots__ = ("digest",)
+
+    def __init__(self, digest: str) -> None:
+        self.digest = digest
+
+    def __getstate__(self) -> dict:
+        return {"digest": self.digest}
+
+    def __setstate__(self, state: dict) -> None:
+        self.digest = state["digest"]
+
+
+class LazyUserData(dict):
+    # large values are kept as BlobRef and read from the blobs table on first access
+
+    def __init__(self, loader, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._loader = loader
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if isinstance(value, BlobRef):
+            value = self._loader(value.digest)
+            super().__setitem__(key, value)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def pop(self, key, *default):
+        value = super().pop(key, *default)
+        if isinstance(value, BlobRef):
+            value = self._loader(value.digest)
+        return value
+
+    def __reduce__(self):
+        # copies keep the BlobRef values and the loader, blobs are read only when accessed
+        return LazyUserData, (self._loader,), None, None, iter(dict.items(self))
+
+    def __deepcopy__(self, memo: dict):
+        # the loader is shared, deepcopy would otherwise copy the persistence it is bound to
+        copied = LazyUserData(self._loader)
+        memo[id(self)] = copied
+        for key, value in dict.items(self):
+            dict.__setitem__(copied, copy.deepcopy(key, memo), copy.deepcopy(value, memo))
+        return copied
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, filepath: str = PERSISTENCE_PATH, store_data: PersistenceInput = None,
+                 update_interval: float = 60, namespace: str = None, collect_garbage: bool = True) -> None:
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.filepath = filepath
+        # processes sharing the file keep their own bot_data and callback_data
+        self.namespace = namespace
+        self.collect_garbage = collect_garbage
+        self._connection = None
+        self._digests = {}
+        self._known_blobs = set()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.filepath, timeout=BUSY_TIMEOUT)
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("PRAGMA synchronous = NORMAL")
+            self._connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+                CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+                CREATE TABLE IF NOT EXISTS singletons (name TEXT PRIMARY KEY, data BLOB NOT NULL);
+                CREATE TABLE IF NOT EXISTS conversations (
+                    name TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    state BLOB NOT NULL,
+                    PRIMARY KEY (name, key)
+                );
+                CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, data BLOB NOT NULL);
+                CREATE TABLE IF NOT EXISTS user_blobs (
+                    user_id INTEGER NOT NULL,
+                    digest TEXT NOT NULL,
+                    PRIMARY KEY (user_id, digest)
+                );
+                -- the last change of every user, seq only grows so readers can ask for what is new
+                CREATE TABLE IF NOT EXISTS user_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL UNIQUE
+                );
+                """
+            )
+        return self._connection
+
+    def _singleton_name(self, name: str) -> str:
+        return name if self.namespace is None else f"{name}:{self.namespace}"
+
+    def _dumps(self, obj) -> bytes:
+        buffer = io.BytesIO()
+        BotPickler(self.bot, buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+        return buffer.getvalue()
+
+    def _loads(self, data: bytes):
+        return BotUnpickler(self.bot, io.BytesIO(data)).load()
+
+    def _write_if_changed(self, table: str, column: str, key, data: bytes) -> bool:
+        digest = hashlib.sha1(data).digest()
+        if self._digests.get((table, key)) == digest:
+            return False
+        connection = self._connect()
+        with connection:
+            connection.execute(f"INSERT OR REPLACE INTO {table} ({column}, data) VALUES (?, ?)", (key, data))
+        self._digests[(table, key)] = digest
+        return True
+
+    def _load_blob(self, digest: str) -> str:
+        row = self._connect().execute("SELECT data FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        return zlib.decompress(row[0]).decode()
+
+    def _store_blob(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        if digest not in self._known_blobs:
+            connection = self._connect()
+            if connection.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone() is None:
+                with connection:
+                    connection.execute("INSERT INTO blobs (digest, data) VALUES (?, ?)",
+                                       (digest, zlib.compress(text.encode())))
+            self._known_blobs.add(digest)
+        return digest
+
+    def data_version(self) -> int:
+        # changes whenever another connection, e.g. another worker process, commits to the file
+        return self._connect().execute("PRAGMA data_version").fetchone()[0]
+
+    def _log_user_change(self, connection: sqlite3.Connection, user_id: int) -> None:
+        connection.execute("DELETE FROM user_changes WHERE user_id = ?", (user_id,))
+        connection.execute("INSERT INTO user_changes (user_id) VALUES (?)", (user_id,))
+
+    def last_user_change(self) -> int:
+        return self._connect().execute("SELECT COALESCE(MAX(seq), 0) FROM user_changes").fetchone()[0]
+
+    def read_changed_user_data(self, since: int) -> tuple:
+        # users written by other connections after the change since, dropped users map to None;
+        # rows this process wrote or read last are skipped, its own copies may be newer
+        rows = self._connect().execute(
+            "SELECT user_changes.seq, user_changes.user_id, user_data.data FROM user_changes "
+            "LEFT JOIN user_data ON user_data.user_id = user_changes.user_id "
+            "WHERE user_changes.seq > ? ORDER BY user_changes.seq", (since,)
+        ).fetchall()
+        changed = {}
+        for seq, user_id, data in rows:
+            since = seq
+            if data is None:
+                changed[user_id] = None
+            elif self._digests.get(("user_data", user_id)) != hashlib.sha1(data).digest():
+                changed[user_id] = LazyUserData(self._load_blob, self._loads(data))
+        return since, changed
+
+    def read_user_data(self) -> dict:
+        # the stored state of every user, the copies held by the application are left alone
+        rows = self._connect().execute("SELECT user_id, data FROM user_data").fetchall()
+        return {user_id: LazyUserData(self._load_blob, self._loads(data)) for user_id, data in rows}
+
+    async def get_user_data(self) -> dict:
+        rows = self._connect().execute("SELECT user_id, data FROM user_data").fetchall()
+        user_data = {}
+        for user_id, data in rows:
+            user_data[user_id] = LazyUserData(self._load_blob, self._loads(data))
+            self._digests[("user_data", user_id)] = hashlib.sha1(data).digest()
+        return user_data
+
+    async def get_chat_data(self) -> dict:
+        rows = self._connect().execute("SELECT chat_id, data FROM chat_data").fetchall()
+        chat_data = {}
+        for chat_id, data in rows:
+            chat_data[chat_id] = self._loads(data)
+            self._digests[("chat_data", chat_id)] = hashlib.sha1(data).digest()
+        return chat_data
+
+    async def _get_singleton(self, name: str):
+        name = self._singleton_name(name)
+        row = self._connect().execute("SELECT data FROM singletons WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        self._digests[("singletons", name)] = hashlib.sha1(row[0]).digest()
+        return self._loads(row[0])
+
+    async def get_bot_data(self) -> dict:
+        bot_data = await self._get_singleton("bot_data")
+        return {} if bot_data is None else bot_data
+
+    async def get_callback_data(self):
+        return await self._get_singleton("callback_data")
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = self._connect().execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        connection = self._connect()
+        with connection:
+            if new_state is None:
+                connection.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, json.dumps(key)))
+            else:
+                connection.execute("INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                                   (name, json.dumps(key), pickle.dumps(new_state)))
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        raw = {}
+        blob_digests = []
+        for key, value in dict.items(data):
+            if key in BLOB_KEYS and isinstance(value, str) and len(value) >= BLOB_MIN_SIZE:
+                value = BlobRef(self._store_blob(value))
+            if isinstance(value, BlobRef):
+                blob_digests.append(value.digest)
+            raw[key] = value
+
+        if self._write_if_changed("user_data", "user_id", user_id, self._dumps(raw)):
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM user_blobs WHERE user_id = ?", (user_id,))
+                connection.executemany("INSERT OR IGNORE INTO user_blobs (user_id, digest) VALUES (?, ?)",
+                                       [(user_id, digest) for digest in blob_digests])
+                self._log_user_change(connection, user_id)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._write_if_changed("chat_data", "chat_id", chat_id, self._dumps(data))
+
+    async def update_bot_data(self, data: dict) -> None:
+        self._write_if_changed("singletons", "name", self._singleton_name("bot_data"), self._dumps(data))
+
+    async def update_callback_data(self, data) -> None:
+        self._write_if_changed("singletons", "name", self._singleton_name("callback_data"), self._dumps(data))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+            connection.execute("DELETE FROM user_blobs WHERE user_id = ?", (user_id,))
+            self._log_user_change(connection, user_id)
+        self._digests.pop(("user_data", user_id), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM chat_data WHERE chat_id = ?", (chat_id,))
+        self._digests.pop(("chat_data", chat_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        # another process sharing the file may have written the row since it was read or written here
+        row = self._connect().execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return
+        digest = hashlib.sha1(row[0]).digest()
+        if self._digests.get(("user_data", user_id)) == digest:
+            return
+        stored = self._loads(row[0])
+        if not isinstance(user_data, LazyUserData):
+            stored = {key: self._load_blob(value.digest) if isinstance(value, BlobRef) else value
+                      for key, value in stored.items()}
+        dict.clear(user_data)
+        dict.update(user_data, stored)
+        self._digests[("user_data", user_id)] = digest
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    def delete_unreferenced_blobs(self) -> None:
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM blobs WHERE digest NOT IN (SELECT digest FROM user_blobs)")
+
+    async def flush(self) -> None:
+        if self._connection is None:
+            return
+        # with several writers a blob may not be referenced yet, the owner of the file collects them
+        if self.collect_garbage:
+            self.delete_unreferenced_blobs()
+        self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._connection.close()
+        self._connection = None
+        self._known_blobs.clear()
+
+
+async def import_pickle_persistence(pickle_path: str, sqlite_path: str = PERSISTENCE_PATH) -> None:
+    # persistence that stores callback_data only accepts a bot that has it enabled
+    bot = ExtBot("0:import", arbitrary_callback_data=True)
+    source = PicklePersistence(filepath=pickle_path)
+    source.set_bot(bot)
+    target = SQLitePersistence(filepath=sqlite_path)
+    target.set_bot(bot)
+
+    for user_id, data in (await source.get_user_data() or {}).items():
+        await target.update_user_data(user_id, data)
+    for chat_id, data in (await source.get_chat_data() or {}).items():
+        await target.update_chat_data(chat_id, data)
+    await target.update_bot_data(await source.get_bot_data() or {})
+    callback_data = await source.get_callback_data()
+    if callback_data is not None:
+        await target.update_callback_data(callback_data)
+    await target.flush()
+
+
+def main() -> None:
+    # one-off migration of the data written by PicklePersistence
+    asyncio.run(import_pickle_persistence(".hackatton_bot_data"))
+
+
+if __name__ == "__main__":
+    main()
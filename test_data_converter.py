@@ -0,0 +1,56 @@
+import math
+
+import pytest
+
+from data_converter import parse_range
+
+
+INF = math.inf
+
+PARSE_RANGE_CASES = [
+    # units are converted to the base unit of their dimension
+    ("3500-3880 мм", (3500.0, 3880.0, "мм")),
+    ("1,5–2,5 л", (1.5, 2.5, "л")),
+    ("3,5 м", (3500.0, 3500.0, "мм")),
+    ("10 м3", (10000.0, 10000.0, "л")),
+    ("12 В", (12.0, 12.0, "в")),
+    ("100 об/мин", (100.0, 100.0, "об/мин")),
+    ("35 градусов", (35.0, 35.0, "°")),
+    ("не меньше 2 мин", (120.0, INF, "с")),
+    ("не менее 40 л.с.", (29420.0, INF, "вт")),
+    # a word that is not a known unit is kept as its stem
+    ("2 человека", (2.0, 2.0, "человек")),
+    ("6 человек", (6.0, 6.0, "человек")),
+    ("15", (15.0, 15.0, "")),
+    # bound phrases, the longest one decides
+    ("до 1000 кг", (-INF, 1000.0, "кг")),
+    ("до  50  мм", (-INF, 50.0, "мм")),
+    ("не более 5 т", (-INF, 5000.0, "кг")),
+    ("более 60 см", (600.0, INF, "мм")),
+    ("свыше 100 км/ч", (100.0, INF, "км/ч")),
+    ("менее 3 ч", (-INF, 10800.0, "с")),
+    ("не выше 10 %", (-INF, 10.0, "%")),
+    ("мин 5 кВт", (5000.0, INF, "вт")),
+    ("max 7 л", (-INF, 7.0, "л")),
+    ("макс. 20 кг", (-INF, 20.0, "кг")),
+    ("от 2 до 3 м", (2000.0, 3000.0, "мм")),
+    # not a single quantity
+    ("1600 х 570 мм", None),
+    ("4х4", None),
+    ("5 или 6", None),
+    ("нет", None),
+    ("", None),
+    (None, None),
+    (42, None),
+    (["до 1000 кг"], None),
+]
+
+
+@pytest.mark.parametrize("value, expected", PARSE_RANGE_CASES)
+def test_parse_range(value, expected):
+    result = parse_range(value)
+    if expected is None:
+        assert result is None
+    else:
+        assert result[:2] == pytest.approx(expected[:2])
+        assert result[2] == expected[2]
@@ -0,0 +1,56 @@
+import pytest
+
+from feature_index import SEARCH_CONDITION_PATTERN, parse_search_query
+
+
+PARSE_SEARCH_QUERY_CASES = [
+    ("Грузоподъемность>=800 Клиренс>=60 см",
+     [("Грузоподъемность", ">=", 800.0, ""), ("Клиренс", ">=", 60.0, "см")]),
+    ("мощность > 40 л.с.", [("мощность", ">", 40.0, "л.с.")]),
+    ("масса = 1 т", [("масса", "=", 1.0, "т")]),
+    ("Скорость на суше>=40км/ч", [("Скорость на суше", ">=", 40.0, "км/ч")]),
+    ("Расход топлива <= 5 л/ч", [("Расход топлива", "<=", 5.0, "л/ч")]),
+    ("время >= 2 часа", [("время", ">=", 2.0, "часа")]),
+    # separators and decimal commas
+    ("длина<=3,5 м, ширина < 2500 мм", [("длина", "<=", 3.5, "м"), ("ширина", "<", 2500.0, "мм")]),
+    ("объем>=10 м3;масса<2т", [("объем", ">=", 10.0, "м3"), ("масса", "<", 2.0, "т")]),
+    ("ВЫСОТА >= 2 М", [("ВЫСОТА", ">=", 2.0, "м")]),
+    # a condition without a unit next to one with it
+    ("высота >= 2 м ширина >= 2", [("высота", ">=", 2.0, "м"), ("ширина", ">=", 2.0, "")]),
+    ("ширина>=2 мм длина>=1", [("ширина", ">=", 2.0, "мм"), ("длина", ">=", 1.0, "")]),
+    # an unknown unit is not taken for a known one it starts with
+    ("Длина >= 3 мм/ч", [("Длина", ">=", 3.0, "")]),
+    ("клиренс >= 60 см>", [("клиренс", ">=", 60.0, "")]),
+    # malformed queries
+    ("нет условий", []),
+    ("", []),
+    (">= 5", []),
+    ("длина >= ", []),
+    ("длина >= abc", []),
+    ("длина => 5", []),
+]
+
+UNIT_CASES = [
+    # the unit of the condition, or None when the text after the number is not one
+    ("длина >= 5 мм", "мм"),
+    ("длина >= 5 м", "м"),
+    ("длина >= 5 м длина", "м"),
+    ("мощность >= 40 л.с.", "л.с."),
+    ("мощность >= 40 кВт", "кВт"),
+    ("длина >= 5 метров", None),
+    ("длина >= 5 м/ч", None),
+    ("масса >= 5 т ширина", "т"),
+    ("масса >= 5 т<", None),
+]
+
+
+@pytest.mark.parametrize("query, expected", PARSE_SEARCH_QUERY_CASES)
+def test_parse_search_query(query, expected):
+    assert parse_search_query(query) == expected
+
+
+@pytest.mark.parametrize("query, unit", UNIT_CASES)
+def test_search_condition_unit(query, unit):
+    match = SEARCH_CONDITION_PATTERN.search(query)
+    assert match is not None
+    assert match.group(4) == unit
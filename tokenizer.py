@@ -0,0 +1,72 @@
+import tiktoken
+
+
+TOKENIZER_MODEL = "gpt-3.5-turbo"
+TEXT_SEPARATORS = ["\f", "\n\n", "\n"]
+
+_encoding = None
+
+
+def get_encoding() -> tiktoken.Encoding:
+    # loading the vocabulary takes a while, so it is done once and on first use
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+    return _encoding
+
+
+def encode(text: str) -> list:
+    return get_encoding().encode(text, disallowed_special=())
+
+
+def count_tokens(text: str) -> int:
+    return len(encode(text))
+
+
+def truncate_tokens(text: str, token_budget: int) -> str:
+    tokens = encode(text)
+    if len(tokens) <= token_budget:
+        return text
+    # a cut in the middle of a multibyte character decodes to a replacement character
+    return get_encoding().decode(tokens[:token_budget]).rstrip("\ufffd")
+
+
+def _split_units(text: str, token_budget: int, level: int = 0) -> list:
+    if count_tokens(text) <= token_budget:
+        return [text]
+    if level == len(TEXT_SEPARATORS):
+        tokens = encode(text)
+        return [get_encoding().decode(tokens[i:i + token_budget]) for i in range(0, len(tokens), token_budget)]
+
+    units = []
+    for part in text.split(TEXT_SEPARATORS[level]):
+        units.extend(_split_units(part, token_budget, level + 1))
+    return units
+
+
+def split_text(text: str, token_budget: int) -> list:
+    # pages first, then paragraphs, then lines, packed greedily into chunks
+    chunks = []
+    current = []
+    current_tokens = 0
+    for unit in _split_units(text, token_budget):
+        if not unit.strip():
+            continue
+        tokens = count_tokens(unit)
+        if current and current_tokens + tokens > token_budget:
+            chunks.append("\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def main() -> None:
+    pass
+
+
+if __name__ == "__main__":
+    main()
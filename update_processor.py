@@ -0,0 +1,44 @@
+import asyncio
+
+from telegram.ext import BaseUpdateProcessor
+
+
+MAX_CONCURRENT_UPDATES = 256  # updates of one chat still run one at a time
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    # updates of one chat run one after another in arrival order, different chats run concurrently
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES) -> None:
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+
+    async def do_process_update(self, update, coroutine) -> None:
+        chat = getattr(update, "effective_chat", None)
+        if chat is None:
+            await coroutine
+            return
+
+        entry = self._locks.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[chat.id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+def main() -> None:
+    pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from telegram import Bot, Update
+
+import main as bot_app
+from document_cache import document_cache
+from llm_cache import llm_cache
+from metrics import METRICS_PORT, log_event, registry, start_metrics_server
+from ocr_executor import OCR_MAX_WORKERS, ocr_executor
+from sqlite_persistence import SQLitePersistence
+from update_processor import PerChatUpdateProcessor
+from config import TOKEN
+
+
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+WEBHOOK_MAX_CONNECTIONS = 40
+# seconds, a user writing from several chats is served by several workers that share the rows through
+# the store, refresh_user_data picks up what the others wrote
+WORKER_PERSISTENCE_INTERVAL = 1
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_chat_id(data: dict) -> int:
+    # the chat an update belongs to, updates without one are spread by their id
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        if isinstance(value.get("chat"), dict):
+            return value["chat"]["id"]
+        message = value.get("message")
+        if isinstance(message, dict) and isinstance(message.get("chat"), dict):
+            return message["chat"]["id"]
+        if isinstance(value.get("from"), dict):
+            return value["from"]["id"]
+    return data.get("update_id", 0)
+
+
+def worker_for(chat_id: int, workers: int) -> int:
+    return chat_id % workers
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    webhook_path = WEBHOOK_PATH
+    secret = None
+    queues = []
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _reply(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self) -> None:
+        if self.path.split("?")[0] != self.webhook_path:
+            self._reply(404)
+            return
+        if self.secret is not None and self.headers.get(SECRET_HEADER) != self.secret:
+            self._reply(403)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or "update_id" not in data:
+            self._reply(400)
+            return
+
+        # the same chat always lands on the same worker, so its updates keep their order
+        worker = worker_for(update_chat_id(data), len(self.queues))
+        self.queues[worker].put(body)
+        registry.inc("webhook_updates_total", worker=worker)
+        self._reply(200)
+
+
+def start_receiver(queues: list, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT, path: str = WEBHOOK_PATH,
+                   secret: str = None) -> HTTPServer:
+    handler = type("ConfiguredWebhookHandler", (WebhookHandler,), {
+        "webhook_path": path, "secret": secret, "queues": queues,
+    })
+    # a single thread reads the requests in the order they arrive and only forwards them,
+    # the backlog holds every connection Telegram may open meanwhile
+    server_class = type("WebhookServer", (HTTPServer,), {"request_queue_size": WEBHOOK_MAX_CONNECTIONS * 4})
+    server = server_class((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="webhook", daemon=True).start()
+    return server
+
+
+async def serve_worker(worker_id: int, updates, bot_api_url: str = None) -> None:
+    persistence = SQLitePersistence(update_interval=WORKER_PERSISTENCE_INTERVAL, namespace=f"worker{worker_id}",
+                                    collect_garbage=False)
+    application = bot_app.build_application(persistence, PerChatUpdateProcessor(), bot_api_url)
+    loop = asyncio.get_running_loop()
+    async with application:
+        await application.start()
+        log_event("webhook_worker_started", worker=worker_id)
+        try:
+            while True:
+                body = await loop.run_in_executor(None, updates.get)
+                if body is None:
+                    break
+                update = Update.de_json(json.loads(body), application.bot)
+                application.bot.insert_callback_data(update)
+                await application.update_queue.put(update)
+        finally:
+            await application.stop()
+    # post_shutdown is only called by run_polling and run_webhook
+    await bot_app.post_shutdown(application)
+
+
+def run_worker(worker_id: int, updates, bot_api_url: str, ocr_workers: int) -> None:
+    # the receiver stops the workers through their queues
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    ocr_executor.max_workers = ocr_workers
+    ocr_executor.max_in_flight = ocr_workers * 2
+    bot_app.register_metrics()
+    start_metrics_server(port=METRICS_PORT + 1 + worker_id)
+    try:
+        asyncio.run(serve_worker(worker_id, updates, bot_api_url))
+    finally:
+        ocr_executor.shutdown()
+        document_cache.close()
+        llm_cache.close()
+
+
+async def set_webhook(url: str, secret: str = None, bot_api_url: str = None,
+                      max_connections: int = WEBHOOK_MAX_CONNECTIONS) -> None:
+    kwargs = {} if bot_api_url is None else {"base_url": bot_api_url}
+    async with Bot(TOKEN, **kwargs) as telegram_bot:
+        await telegram_bot.set_webhook(url, secret_token=secret, allowed_updates=Update.ALL_TYPES,
+                                       max_connections=max_connections)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Receive updates by webhook and process them in worker processes.")
+    parser.add_argument("--host", default=WEBHOOK_HOST)
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    parser.add_argument("--path", default=WEBHOOK_PATH)
+    parser.add_argument("--url", default=None, help="public URL of the webhook, registered with Telegram when given")
+    parser.add_argument("--secret", default=None, help="secret token Telegram sends with every update")
+    parser.add_argument("-w", "--workers", type=int, default=WEBHOOK_WORKERS, help="bot worker processes")
+    parser.add_argument("--ocr-workers", type=int, default=None, help="OCR processes per bot worker")
+    parser.add_argument("--bot-api-url", default=None, help="e.g. http://127.0.0.1:8081/bot for a local Bot API")
+    args = parser.parse_args()
+
+    ocr_workers = args.ocr_workers or max(1, OCR_MAX_WORKERS // args.workers)
+    # spawned workers do not inherit the receiver thread or open SQLite connections
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue() for _ in range(args.workers)]
+    workers = [context.Process(target=run_worker, name=f"bot-worker-{worker_id}",
+                               args=(worker_id, queues[worker_id], args.bot_api_url, ocr_workers))
+               for worker_id in range(args.workers)]
+    for worker in workers:
+        worker.start()
+
+    for worker_id, queue in enumerate(queues):
+        registry.register_callback("webhook_queue_depth", queue.qsize, worker=worker_id)
+    start_metrics_server()
+    server = start_receiver(queues, args.host, args.port, args.path, args.secret)
+    if args.url:
+        asyncio.run(set_webhook(args.url, args.secret, args.bot_api_url))
+    print(f"Webhook on http://{args.host}:{args.port}{args.path}, {args.workers} workers, "
+          f"{ocr_workers} OCR processes each.")
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        for queue in queues:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+        # blobs are collected once no worker writes any more
+        SQLitePersistence().delete_unreferenced_blobs()
+
+
+if __name__ == "__main__":
+    main()